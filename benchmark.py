@@ -0,0 +1,410 @@
+"""End-to-end update benchmark against a local stand-in of the patch server.
+
+    python benchmark.py --files 200 --size-kb 2048 --distribution lognormal \
+        --latency-ms 30 --bandwidth-kb 20480 -o results.json
+
+A synthetic pack tree and its patchlist.json (made with builder.py) are
+served by a local HTTP server that supports Range, If-Range and ETag, with
+optional latency and bandwidth shaping. The update engine runs headless
+against it, one scenario after the other, each in a fresh client folder:
+
+    fresh       empty client, download everything
+    verify      client up to date, full re-hash of every file
+    resume      fresh download stopped halfway, then resumed
+    one_file    client one version behind, a single file changed
+
+For each run: wall time, bytes served, throughput, requests, bytes hashed
+locally, and the resident memory of the process when the run started and its
+peak while it ran (sampled, since every scenario shares one process). Results are written as JSON so runs of
+different versions can be compared.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:  # optional: without it RSS is read from /proc (Linux only)
+    psutil = None
+
+import builder
+import config
+import hashing
+import scheduler
+from engine import UpdateEngine
+
+
+class PatchServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+
+    def do_GET(self):
+        self.server.count_request()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        path = os.path.join(self.server.root, *self.path.split("?")[0].strip("/").split("/"))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = self.date_time_string(stat.st_mtime)
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        partial = bool(range_header) and if_range in (None, etag, last_modified)
+        if partial:
+            try:
+                first, last = range_header.split("=", 1)[1].split("-", 1)
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            except ValueError:
+                self.send_error(400)
+                return
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Accept-Ranges", "bytes")
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        remaining = end - start + 1
+        with open(path, "rb") as f:
+            f.seek(start)
+            while remaining:
+                block = f.read(min(64 * 1024, remaining))
+                if not block:
+                    break
+                self.server.bandwidth.consume(len(block))
+                try:
+                    self.wfile.write(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    return  # il client ha interrotto il download
+                self.server.count_bytes(len(block))
+                remaining -= len(block)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PatchServer(ThreadingHTTPServer):
+    """Local HTTP server for the benchmark, counting requests and bytes sent."""
+
+    daemon_threads = True
+
+    def __init__(self, root, latency=0.0, bandwidth=0):
+        super().__init__(("127.0.0.1", 0), PatchServerHandler)
+        self.root = root
+        self.latency = latency
+        # Stessa logica del limite lato client, condiviso tra tutte le connessioni
+        self.bandwidth = scheduler.TokenBucket(bandwidth, burst_seconds=0.1)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def count_bytes(self, amount):
+        with self.lock:
+            self.bytes_sent += amount
+
+    def stats(self):
+        with self.lock:
+            return self.requests, self.bytes_sent
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class HashCounter:
+    """Count the bytes the engine reads back from disk to hash them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_hashed = 0
+        self.original = None
+
+    def hash_file(self, file_path, *args, **kwargs):
+        digest = self.original(file_path, *args, **kwargs)
+        with self.lock:
+            self.bytes_hashed += os.path.getsize(file_path)
+        return digest
+
+    def __enter__(self):
+        self.original = hashing.hash_file
+        hashing.hash_file = self.hash_file
+        return self
+
+    def __exit__(self, *exc_info):
+        hashing.hash_file = self.original
+
+
+def current_rss():
+    """Resident memory of this process in bytes right now, None where unsupported."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """Peak RSS during one run, sampled every interval seconds.
+
+    getrusage only gives the peak of the whole process, which would charge
+    every scenario for the ones that ran before it in the same process.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_rss = None
+        self.peak = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+        return rss
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.start_rss = self.sample()
+        if self.start_rss is not None:
+            self.thread = threading.Thread(target=self.loop, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sample()
+
+
+def file_sizes(count, size, distribution, rng):
+    """Sizes of the synthetic pack files, averaging about size bytes."""
+    if distribution == "fixed":
+        return [size] * count
+    if distribution == "uniform":
+        return [rng.randint(size // 2, size * 3 // 2) for _ in range(count)]
+    # lognormal: molti file piccoli e qualche file molto grande, come i veri pack
+    sigma = 1.0
+    mu = math.log(size) - sigma * sigma / 2
+    return [max(1, int(rng.lognormvariate(mu, sigma))) for _ in range(count)]
+
+
+def random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def make_pack(pack_dir, sizes, rng):
+    os.makedirs(pack_dir, exist_ok=True)
+    for index, size in enumerate(sizes):
+        with open(os.path.join(pack_dir, f"bench{index:05d}.epk"), "wb") as f:
+            f.write(random_bytes(rng, size))
+
+
+def publish(server_root, version):
+    """Build patchlist.json for the server pack folder, as the real server would."""
+    pack_dir = os.path.join(server_root, "pack")
+    patchlist_path = os.path.join(server_root, "patchlist.json")
+    pack_builder = builder.PatchlistBuilder(pack_dir, os.path.join(server_root, "cache.pkl"))
+    entries = pack_builder.build(version)
+    builder.write_patchlist(patchlist_path, entries, f"patch_{version}")
+
+
+class Benchmark:
+    def __init__(self, work_dir, latency, bandwidth):
+        self.work_dir = work_dir
+        self.server_root = os.path.join(work_dir, "server")
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def client(self, name, copy_pack=False):
+        """Fresh client folder, optionally holding a copy of the server pack."""
+        client_dir = os.path.join(self.work_dir, name)
+        shutil.rmtree(client_dir, ignore_errors=True)
+        if copy_pack:
+            shutil.copytree(os.path.join(self.server_root, "pack"), os.path.join(client_dir, "pack"))
+        else:
+            os.makedirs(os.path.join(client_dir, "pack"))
+        return client_dir
+
+    def run(self, client_dir, client_version, stop_at=None, **engine_options):
+        """Run one update in client_dir and measure it."""
+        cwd = os.getcwd()
+        os.chdir(client_dir)  # version, file-state and patchlist cache are relative paths
+        try:
+            with PatchServer(self.server_root, self.latency, self.bandwidth) as server:
+                engine = None
+
+                def listener(event, *args):
+                    if stop_at is not None and event == "transfer_progress" and args[0] >= stop_at:
+                        engine.stop()
+
+                engine = UpdateEngine(
+                    client_version,
+                    f"{server.url}/patchlist.json",
+                    f"{server.url}/pack",
+                    "pack",
+                    ".",
+                    listener=listener,
+                    **engine_options,
+                )
+                with HashCounter() as counter, RssSampler() as memory:
+                    started = time.perf_counter()
+                    completed = engine.run()
+                    wall_time = time.perf_counter() - started
+                requests, bytes_sent = server.stats()
+        finally:
+            os.chdir(cwd)
+        return {
+            "completed": completed,
+            "wall_time": round(wall_time, 3),
+            "bytes_served": bytes_sent,
+            "throughput": round(bytes_sent / wall_time) if wall_time > 0 else None,
+            "requests": requests,
+            "bytes_hashed": counter.bytes_hashed,
+            "rss_start": memory.start_rss,
+            "peak_rss_run": memory.peak,
+        }
+
+    def fresh(self):
+        return self.run(self.client("fresh"), "1.0")
+
+    def verify(self):
+        return self.run(
+            self.client("verify", copy_pack=True),
+            "patch_1.0",
+            force_full_verify=True,
+            verify_tier="full",
+        )
+
+    def resume(self):
+        client_dir = self.client("resume")
+        interrupted = self.run(client_dir, "1.0", stop_at=50)
+        resumed = self.run(client_dir, "1.0")
+        return {"interrupted": interrupted, "resumed": resumed}
+
+    def one_file(self):
+        """Change one file on the server and update a client of the previous version."""
+        client_dir = self.client("one_file", copy_pack=True)
+        pack_dir = os.path.join(self.server_root, "pack")
+        name = sorted(os.listdir(pack_dir))[0]
+        path = os.path.join(pack_dir, name)
+        size = os.path.getsize(path)
+        with open(path, "wb") as f:
+            f.write(random_bytes(random.Random(size), size))
+        publish(self.server_root, "1.1")
+        return self.run(client_dir, "patch_1.0")
+
+
+SCENARIOS = ["fresh", "verify", "resume", "one_file"]  # one_file changes the server pack: last
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark updates against a local patch server.")
+    parser.add_argument("--files", type=int, default=100, help="files in the synthetic pack")
+    parser.add_argument("--size-kb", type=int, default=1024, help="average file size in KB")
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every request")
+    parser.add_argument("--bandwidth-kb", type=int, default=0, help="server bandwidth in KB/s, 0 = none")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="default: all")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--work-dir", help="kept after the run; default: a temporary folder")
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    args = parser.parse_args(argv)
+
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="autopatcher-bench-"))
+    benchmark = Benchmark(work_dir, args.latency_ms / 1000, args.bandwidth_kb * 1024)
+    rng = random.Random(args.seed)
+    sizes = file_sizes(args.files, args.size_kb * 1024, args.distribution, rng)
+    try:
+        shutil.rmtree(benchmark.server_root, ignore_errors=True)
+        print(f"Generating {args.files} files ({sum(sizes) / 1048576:.1f} MB) in {work_dir}")
+        make_pack(os.path.join(benchmark.server_root, "pack"), sizes, rng)
+        publish(benchmark.server_root, "1.0")
+
+        results = {}
+        for name in [name for name in SCENARIOS if name in (args.scenario or SCENARIOS)]:
+            print(f"Running {name}...")
+            results[name] = getattr(benchmark, name)()
+            print(json.dumps(results[name], indent=4))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "files": args.files,
+            "total_bytes": sum(sizes),
+            "distribution": args.distribution,
+            "latency_ms": args.latency_ms,
+            "bandwidth_kb": args.bandwidth_kb,
+            "seed": args.seed,
+            "download_workers": config.download_workers,
+            "hash_workers": hashing.pick_workers(os.getcwd()),
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
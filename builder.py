@@ -0,0 +1,350 @@
+"""Build patchlist.json from the server pack folder.
+
+    python builder.py SERVER_PACK --version 1.3 --patcher _TheSeedPatcher.exe \\
+        [--previous-pack OLD_PACK] [--previous-patcher OLD_PATCHER] \\
+        [--chunks] [--samples] [--compress xz] [-o patchlist.json]
+
+Hashes of unchanged files come from a cache keyed on size, mtime and inode,
+so only new or modified files are read again.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import chunks
+import compression
+import config
+import delta
+import hashing
+from state import FileStateIndex
+
+
+SIDECAR_DIRS = ("deltas", "compressed")
+
+
+def scan_pack(pack_dir):
+    """Relative names ("/" separated) of every file served from the pack folder."""
+    names = []
+    for root, dirs, files in os.walk(pack_dir):
+        if os.path.samefile(root, pack_dir):
+            dirs[:] = [d for d in dirs if d not in SIDECAR_DIRS]
+        for file in files:
+            if file.endswith((".tmp", ".part", ".part.json")):
+                continue
+            relative = os.path.relpath(os.path.join(root, file), pack_dir)
+            names.append(relative.replace(os.sep, "/"))
+    return sorted(names)
+
+
+class PatchlistBuilder:
+    def __init__(self, pack_dir, cache_file, workers=None):
+        self.pack_dir = pack_dir
+        self.cache = FileStateIndex(cache_file)
+        self.workers = workers or hashing.pick_workers(pack_dir)
+
+    def path(self, name):
+        return os.path.join(self.pack_dir, *name.split("/"))
+
+    def hash_all(self, paths):
+        """Hash every path, reading only the files the cache does not know."""
+        hashes = {}
+        stale = []
+        for path in paths:
+            known_hash = self.cache.lookup(path)
+            if known_hash is None:
+                stale.append(path)
+            else:
+                hashes[path] = known_hash
+        if stale:
+            print(f"Hashing {len(stale)} of {len(paths)} files...")
+        for path, digest in hashing.hash_files(stale, self.workers):
+            if digest is None:
+                raise OSError(f"Unable to hash {path}")
+            self.cache.record(path, digest)
+            hashes[path] = digest
+        return hashes
+
+    def chunk_all(self, paths, hashes):
+        """Chunk lists for every path, computing only the uncached ones in parallel."""
+        result = {}
+        stale = []
+        for path in paths:
+            known = self.cache.lookup_chunks(path)
+            if known is None:
+                stale.append(path)
+            else:
+                result[path] = known
+        if stale:
+            print(f"Chunking {len(stale)} files...")
+            # Il chunking e puro Python: servono processi, non thread
+            with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                for path, file_chunks in zip(stale, executor.map(chunks.file_chunks, stale)):
+                    self.cache.remember_chunks(path, hashes[path], file_chunks)
+                    result[path] = file_chunks
+        return result
+
+    def sample_all(self, paths, hashes):
+        """Sampled block hashes for the fast launch check, cached like the hashes."""
+
+        def samples_of(path):
+            known = self.cache.lookup_field(path, "samples")
+            if known is None:
+                known = hashing.make_samples(path)
+                self.cache.remember_field(path, hashes[path], "samples", known)
+            return known
+
+        return dict(hashing.run_parallel(samples_of, paths, self.workers))
+
+    def compress_all(self, names, paths, hashes, compression_format, min_saving):
+        """Write compressed copies in pack_dir/compressed, reusing the ones already there.
+
+        Returns {path: entry} for the files where compression saves at least
+        min_saving of the size; the others are served uncompressed.
+        """
+        suffix = compression.SUFFIXES[compression_format]
+        os.makedirs(os.path.join(self.pack_dir, "compressed"), exist_ok=True)
+
+        def saves_enough(path, size):
+            return size <= os.path.getsize(path) * (1 - min_saving)
+
+        def compress(item):
+            name, path = item
+            relative = f"compressed/{name}.{hashes[path][:16]}{suffix}"
+            target = self.path(relative)
+            if os.path.exists(target):
+                return relative, os.path.getsize(target)
+            rejected = self.cache.lookup_field(path, "rejected_compression") or {}
+            known_size = rejected.get(compression_format)
+            if known_size is not None and not saves_enough(path, known_size):
+                return relative, known_size  # gia provato: non conviene, niente ricompressione
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            return relative, compression.compress_file(path, target, compression_format)
+
+        result = {}
+        # zlib e lzma rilasciano il GIL, bastano i thread
+        for (name, path), (relative, size) in hashing.run_parallel(
+            compress, list(zip(names, paths)), os.cpu_count() or 1
+        ):
+            if saves_enough(path, size):
+                result[path] = {"format": compression_format, "file": relative, "size": size}
+            elif os.path.exists(self.path(relative)):
+                os.remove(self.path(relative))
+                # La dimensione resta nella cache: le prossime build non ricomprimono il file
+                rejected = dict(self.cache.lookup_field(path, "rejected_compression") or {})
+                rejected[compression_format] = size
+                self.cache.remember_field(path, hashes[path], "rejected_compression", rejected)
+        return result
+
+    def cached_hash(self, path):
+        known_hash = self.cache.lookup(path)
+        if known_hash is None:
+            known_hash = hashing.hash_file(path)
+            self.cache.record(path, known_hash)
+        return known_hash
+
+    def build(
+        self,
+        version,
+        exe_names=(),
+        patcher_path=None,
+        with_chunks=False,
+        with_samples=False,
+        previous_pack=None,
+        compression_format=None,
+        min_saving=0.05,
+        previous_patcher=None,
+    ):
+        """Return the patchlist entries for this pack folder."""
+        names = scan_pack(self.pack_dir)
+        paths = [self.path(name) for name in names]
+        hashes = self.hash_all(paths + ([patcher_path] if patcher_path else []))
+        file_chunks = self.chunk_all(paths, hashes) if with_chunks else {}
+        samples = self.sample_all(paths, hashes) if with_samples else {}
+        compressed = {}
+        if compression_format:
+            compressed = self.compress_all(names, paths, hashes, compression_format, min_saving)
+        deltas = {}
+        if previous_pack:
+            deltas = delta.build_deltas(
+                previous_pack, self.pack_dir, self.pack_dir, hash_of=self.cached_hash
+            )
+
+        files = []
+        exe = {}
+        for name, path in zip(names, paths):
+            file_info = {"hash": hashes[path], "size": os.path.getsize(path)}
+            if path in file_chunks:
+                file_info["chunks"] = file_chunks[path]
+            if path in samples:
+                file_info["samples"] = samples[path]
+            if name in deltas:
+                file_info["deltas"] = deltas[name]
+            if path in compressed:
+                file_info["compressed"] = compressed[path]
+            if name in exe_names:
+                exe[name] = file_info
+            else:
+                files.append({name: file_info})
+
+        entries = {f"patch_{version}": files, "exe": exe}
+        if patcher_path:
+            entries["patcher"] = {
+                "hash": hashes[patcher_path],
+                "size": os.path.getsize(patcher_path),
+            }
+            if previous_patcher:
+                patcher_delta = self.patcher_delta(
+                    previous_patcher, patcher_path, hashes[patcher_path]
+                )
+                if patcher_delta:
+                    entries["patcher"]["deltas"] = patcher_delta
+        self.cache.save()
+        return entries
+
+
+    def patcher_delta(self, old_path, new_path, new_hash, max_ratio=0.5):
+        """Delta from the previous patcher, written next to the new one for patcher_folder."""
+        old_hash = self.cached_hash(old_path)
+        if old_hash == new_hash:
+            return {}
+        relative = delta.delta_name(os.path.basename(new_path), old_hash, new_hash)
+        patcher_dir = os.path.dirname(os.path.abspath(new_path))
+        delta_path = os.path.join(patcher_dir, *relative.split("/"))
+        if os.path.exists(delta_path):
+            size = os.path.getsize(delta_path)
+        else:
+            os.makedirs(os.path.dirname(delta_path), exist_ok=True)
+            size = delta.make_delta(old_path, new_path, delta_path)
+            print(f"Patcher: delta {size} bytes")
+        if size > os.path.getsize(new_path) * max_ratio:
+            print(f"Patcher: delta too big ({size} bytes), skipped")
+            return {}
+        return {old_hash: {"file": relative, "hash": hashing.hash_file(delta_path), "size": size}}
+
+
+def patch_sort_key(patch_key):
+    return float(patch_key.split("_")[1])
+
+
+def file_hashes(patchlist, patch_key):
+    """{name: hash} of every pack and exe file of a patch."""
+    hashes = {
+        file: file_info["hash"]
+        for patch in patchlist.get(patch_key, [])
+        for file, file_info in patch.items()
+    }
+    hashes.update(
+        {exe: file_info["hash"] for exe, file_info in patchlist.get("exe", {}).items()}
+    )
+    return hashes
+
+
+def update_history(patchlist, entries, patch_key, limit):
+    """Add the step from the previous newest patch to patch_key to the history.
+
+    Each step lists the files changed and removed by one version and links to
+    the version before it, so clients can follow the chain from the version
+    they have and touch only those files.
+    """
+    history = dict(patchlist.get("history", {}))
+    old_keys = [key for key in patchlist if key.startswith("patch_")]
+    if old_keys:
+        old_key = max(old_keys, key=patch_sort_key)
+        old_hashes = file_hashes(patchlist, old_key)
+        new_hashes = file_hashes(entries, patch_key)
+        changed = {file for file, h in new_hashes.items() if old_hashes.get(file) != h}
+        removed = set(old_hashes) - set(new_hashes)
+        previous_key = old_key
+        if old_key == patch_key:
+            # Stessa versione ricostruita: allarga il passo gia pubblicato
+            step = history.get(patch_key)
+            if step is None:
+                return history
+            changed.update(step["changed"])
+            removed.update(step["removed"])
+            previous_key = step["from"]
+        history[patch_key] = {
+            "from": previous_key,
+            "changed": sorted(changed),
+            "removed": sorted(removed - set(new_hashes)),
+        }
+    for key in sorted(history, key=patch_sort_key)[:-limit]:
+        del history[key]
+    return history
+
+
+def write_patchlist(output, entries, patch_key, history_limit=50):
+    """Merge the new entries into output and replace the file atomically."""
+    patchlist = {}
+    if os.path.exists(output):
+        with open(output, "r", encoding="utf-8") as f:
+            patchlist = json.load(f)
+    history = update_history(patchlist, entries, patch_key, history_limit)
+    # Le versioni vecchie sono descritte dalla history, il client usa solo l'ultima
+    for key in [key for key in patchlist if key.startswith("patch_")]:
+        del patchlist[key]
+    patchlist.update(entries)
+    if history:
+        patchlist["history"] = history
+    temp_path = output + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(patchlist, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build patchlist.json from the server pack folder.")
+    parser.add_argument("pack_dir", help="server folder served as pack_url")
+    parser.add_argument("--version", required=True, help="new version, written as patch_<version>")
+    parser.add_argument("-o", "--output", default="patchlist.json")
+    parser.add_argument(
+        "--exe",
+        action="append",
+        default=None,
+        help=f"file in pack_dir that goes in the exe section (default {config.exe_name})",
+    )
+    parser.add_argument("--patcher", help="patcher executable players self-update to")
+    parser.add_argument(
+        "--previous-patcher", help="patcher executable players have now, to build a delta"
+    )
+    parser.add_argument("--chunks", action="store_true", help="add chunk manifests")
+    parser.add_argument(
+        "--samples", action="store_true", help="add sampled block hashes for the fast check"
+    )
+    parser.add_argument(
+        "--compress", choices=compression.supported_formats(), help="add compressed copies"
+    )
+    parser.add_argument(
+        "--min-saving", type=float, default=0.05, help="drop compressed copies that save less"
+    )
+    parser.add_argument("--previous-pack", help="pack folder of the previous version, to build deltas")
+    parser.add_argument("--cache", default="patchlist_cache.pkl", help="hash cache file")
+    parser.add_argument("--workers", type=int, default=None, help="files hashed at once")
+    parser.add_argument(
+        "--history", type=int, default=50, help="versions kept in the change history"
+    )
+    args = parser.parse_args(argv)
+
+    builder = PatchlistBuilder(args.pack_dir, args.cache, args.workers)
+    entries = builder.build(
+        args.version,
+        exe_names=args.exe or [config.exe_name],
+        patcher_path=args.patcher,
+        with_chunks=args.chunks,
+        with_samples=args.samples,
+        previous_pack=args.previous_pack,
+        compression_format=args.compress,
+        min_saving=args.min_saving,
+        previous_patcher=args.previous_patcher,
+    )
+    write_patchlist(args.output, entries, f"patch_{args.version}", args.history)
+    print(f"Wrote {args.output} ({len(entries[f'patch_{args.version}'])} files)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""Content-defined chunk manifests for pack files.
+
+Each file in the patchlist can list its chunks as [hash, size] pairs under
+"chunks". Chunk boundaries depend only on the bytes around them (gear hash,
+FastCDC style), so an insertion only changes the chunks it touches and the
+same data in two files or two versions gives the same chunks.
+
+Server side, add chunk lists to the newest patch of a patchlist:
+
+    python chunks.py patchlist.json PACK_DIR
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+
+import config
+import download
+import scheduler
+import transport
+
+
+MIN_CHUNK = 256 * 1024
+AVG_CHUNK_BITS = 20  # chunk medi da 1 MB
+MAX_CHUNK = 4 * 1024 * 1024
+MASK_64 = (1 << 64) - 1
+# Normalized chunking: harder to cut before the average size, easier after it
+MASK_SMALL = (1 << (AVG_CHUNK_BITS + 1)) - 1
+MASK_LARGE = (1 << (AVG_CHUNK_BITS - 1)) - 1
+GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)
+]
+COPY_BLOCK = 1024 * 1024
+
+
+class ChunkError(Exception):
+    pass
+
+
+def chunk_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def _next_boundary(data, start, end):
+    """Length of the chunk starting at start."""
+    remaining = end - start
+    if remaining <= MIN_CHUNK:
+        return remaining
+    limit = min(remaining, MAX_CHUNK)
+    middle = min(limit, 1 << AVG_CHUNK_BITS)
+    # The gear hash only depends on the last 64 bytes, start just before MIN_CHUNK
+    h = 0
+    pos = start + MIN_CHUNK - 64
+    for byte in data[pos : start + middle]:
+        h = ((h << 1) + GEAR[byte]) & MASK_64
+        pos += 1
+        if pos - start >= MIN_CHUNK and not h & MASK_SMALL:
+            return pos - start
+    for byte in data[start + middle : start + limit]:
+        h = ((h << 1) + GEAR[byte]) & MASK_64
+        pos += 1
+        if not h & MASK_LARGE:
+            return pos - start
+    return limit
+
+
+def file_chunks(file_path):
+    """Split a file into content-defined chunks, return [[hash, size], ...]."""
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            result = []
+            offset = 0
+            while offset < size:
+                length = _next_boundary(data, offset, size)
+                result.append([chunk_hash(data[offset : offset + length]), length])
+                offset += length
+            return result
+
+
+def chunk_offsets(chunks):
+    """Yield (hash, offset, size) for a chunk list."""
+    offset = 0
+    for digest, size in chunks:
+        yield digest, offset, size
+        offset += size
+
+
+def missing_ranges(chunks, available):
+    """Byte ranges of the new file that must be downloaded, merged when close."""
+    ranges = []
+    for digest, offset, size in chunk_offsets(chunks):
+        if digest in available:
+            continue
+        if ranges and offset - ranges[-1][1] <= config.chunk_merge_gap:
+            ranges[-1][1] = offset + size
+        else:
+            ranges.append([offset, offset + size])
+    return ranges
+
+
+def rebuild_file(
+    url,
+    out_path,
+    chunks,
+    available,
+    expected_hash,
+    on_progress=None,
+    should_continue=None,
+    stats=None,
+):
+    """Write the file described by chunks into out_path.
+
+    available maps chunk hash -> (path, offset, size) of a local copy of that
+    chunk; every other byte is fetched from url with a few Range requests.
+    Returns False if should_continue() asked to stop. If given, stats is
+    filled like download.download_to_file does: connect_time, ttfb and
+    bytes_received of the Range requests.
+    """
+    stats = {} if stats is None else stats
+    ranges = missing_ranges(chunks, available)
+    to_download = sum(end - start for start, end in ranges)
+    downloaded = 0
+    h = hashlib.sha256()
+    sources = {}
+    try:
+        with open(out_path, "wb") as out:
+            position = 0
+            range_index = 0
+            for digest, offset, size in chunk_offsets(chunks):
+                if offset < position:
+                    continue  # gia scritto da una richiesta Range unita
+                if range_index < len(ranges) and ranges[range_index][0] == offset:
+                    start, end = ranges[range_index]
+                    range_index += 1
+                    for block in _fetch_range(url, start, end, stats):
+                        if should_continue is not None and not should_continue():
+                            return False
+                        out.write(block)
+                        h.update(block)
+                        downloaded += len(block)
+                        if on_progress is not None:
+                            on_progress(downloaded, to_download)
+                    position = end
+                    continue
+                path, source_offset, _ = available[digest]
+                if path not in sources:
+                    sources[path] = open(path, "rb")
+                source = sources[path]
+                source.seek(source_offset)
+                data = source.read(size)
+                if len(data) != size or chunk_hash(data) != digest:
+                    raise ChunkError(f"local chunk {digest} in {path} changed")
+                out.write(data)
+                h.update(data)
+                position = offset + size
+            out.flush()
+            os.fsync(out.fileno())
+    finally:
+        for source in sources.values():
+            source.close()
+    if h.hexdigest() != expected_hash.lower():
+        raise ChunkError(f"rebuilt file does not match the patchlist hash ({url})")
+    return True
+
+
+def _fetch_range(url, start, end, stats):
+    with transport.get(
+        url, stream=True, headers={"Range": f"bytes={start}-{end - 1}"}
+    ) as response:
+        connect_time, ttfb = transport.last_timing()
+        download.add_stat(stats, "connect_time", connect_time)
+        stats.setdefault("ttfb", ttfb)  # la prima richiesta, come nei download a segmenti
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise ChunkError(f"{url} does not support Range requests")
+        received = 0
+        for block in response.iter_content(chunk_size=config.download_chunk_size):
+            scheduler.bandwidth.consume(len(block))
+            received += len(block)
+            download.add_stat(stats, "bytes_received", len(block))
+            yield block
+        if received != end - start:
+            raise ChunkError(f"short Range response from {url}")
+
+
+def add_chunks_to_patchlist(patchlist, patch_key, pack_dir):
+    """Fill the "chunks" field of every file of patch_key from pack_dir."""
+    for patch in patchlist[patch_key]:
+        for file, file_info in patch.items():
+            file_path = os.path.join(pack_dir, file)
+            if os.path.isfile(file_path):
+                file_info["chunks"] = file_chunks(file_path)
+                print(f"{file}: {len(file_info['chunks'])} chunks")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add chunk manifests to a patchlist.")
+    parser.add_argument("patchlist", help="patchlist.json to update")
+    parser.add_argument("pack_dir", help="pack folder that matches the newest patch")
+    args = parser.parse_args(argv)
+
+    with open(args.patchlist, "r", encoding="utf-8") as f:
+        patchlist = json.load(f)
+    patch_keys = [key for key in patchlist if key.startswith("patch_")]
+    if not patch_keys:
+        print("No patch key found in the patchlist.")
+        return 1
+    patch_key = max(patch_keys, key=lambda x: float(x.split("_")[1]))
+    add_chunks_to_patchlist(patchlist, patch_key, args.pack_dir)
+    temp_path = args.patchlist + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(patchlist, f, indent=4)
+    os.replace(temp_path, args.patchlist)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
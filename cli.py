@@ -0,0 +1,138 @@
+"""Command line front end of the update engine, for servers, CI and scripts.
+
+    python cli.py check     exit code 0 when up to date, 1 when an update is pending
+    python cli.py plan      print the update plan without downloading anything
+    python cli.py update    bring the client up to date
+    python cli.py verify    re-hash every file and report the ones that are wrong
+
+No display and no PyQt are needed.
+"""
+import argparse
+import os
+import sys
+
+import config
+from engine import UpdateEngine, read_client_version
+from plan import format_size
+from progress import format_eta, format_speed
+
+
+class ConsoleListener:
+    """Print engine events; one line per report, or a single refreshed line on a terminal."""
+
+    def __init__(self, quiet=False, stream=sys.stdout):
+        self.quiet = quiet
+        self.stream = stream
+        self.interactive = stream.isatty()
+        self.open_line = False
+
+    def __call__(self, event, *args):
+        if self.quiet:
+            return
+        if event == "progress_changed":
+            percent, text = args
+            self.write(f"[{percent:3d}%] {text}", refresh=True)
+        elif event == "transfer_progress":
+            percent, file_name, speed, eta = args
+            text = f"[{percent:3d}%] {file_name} {format_speed(speed)}"
+            if eta >= 0:
+                text += f" ETA {format_eta(eta)}"
+            self.write(text, refresh=True)
+        elif event == "file_downloading":
+            self.write(f"Downloading {args[0]}")
+        elif event == "launch_ready":
+            self.write(config.launch_ready_text)
+        elif event == "failed":
+            self.write(args[0])
+        elif event == "finished":
+            self.write(config.update_complete)
+
+    def end_line(self):
+        if self.open_line:
+            self.stream.write("\n")
+            self.stream.flush()
+            self.open_line = False
+
+    def write(self, text, refresh=False):
+        if self.interactive and refresh:
+            self.stream.write("\r" + text.ljust(79))
+            self.open_line = True
+        else:
+            self.end_line()
+            self.stream.write(text + "\n")
+        self.stream.flush()
+
+
+def create_engine(args, listener=None):
+    if not os.path.exists(args.pack_path):
+        os.makedirs(args.pack_path)
+    force_full_verify = args.command == "verify" or args.full_verify
+    verify_tier = "full" if force_full_verify else args.tier
+    engine = UpdateEngine(
+        read_client_version(args.version_file),
+        args.patchlist_url,
+        args.pack_url,
+        args.pack_path,
+        args.exe_folder,
+        force_full_verify=force_full_verify,
+        verify_tier=verify_tier,
+        listener=listener,
+    )
+    if args.limit is not None:
+        engine.set_bandwidth_limit(args.limit)
+    return engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and update the game client without the GUI.")
+    parser.add_argument("command", choices=["check", "plan", "update", "verify"])
+    parser.add_argument("--patchlist-url", default=config.patchlist_url)
+    parser.add_argument("--pack-url", default=config.pack_url)
+    parser.add_argument("--pack-path", default=config.pack_path, help="local pack folder")
+    parser.add_argument("--exe-folder", default=".", help="folder of the game executables")
+    parser.add_argument("--version-file", default=config.version_file_name)
+    parser.add_argument(
+        "--tier",
+        choices=["size", "sample", "full"],
+        default=config.verify_tier,
+        help="launch check of files missing from the file-state index",
+    )
+    parser.add_argument(
+        "--full-verify", action="store_true", help="re-hash every file (update becomes a repair)"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="bandwidth limit in KB/s, 0 = none")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the result")
+    args = parser.parse_args(argv)
+
+    listener = ConsoleListener(args.quiet)
+    engine = create_engine(args, listener)
+    if args.command == "update":
+        completed = engine.run()
+        listener.end_line()
+        if completed:
+            print(f"Client Version: {engine.client_version}")
+            return 0
+        print("Update failed.")
+        return 1
+
+    plan = engine.check()
+    listener.end_line()
+    if plan is None:
+        return 2
+    if args.command == "check":
+        if plan.is_empty() and engine.client_version == plan.version:
+            print(f"Up to date ({plan.version}).")
+            return 0
+        print(
+            f"Update available: {engine.client_version} -> {plan.version}, "
+            f"{len(plan.to_fetch)} files ({format_size(plan.total_bytes)})"
+        )
+        return 1
+    print(plan.describe())
+    if args.command == "verify":
+        return 0 if not plan.to_fetch else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import lzma
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip and xz come with Python
+    zstandard = None
+
+
+SUFFIXES = {"gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+BLOCK = 1024 * 1024
+
+
+def supported_formats():
+    """Compression formats this installation can decompress."""
+    formats = ["gzip", "xz"]
+    if zstandard is not None:
+        formats.append("zstd")
+    return formats
+
+
+class _ZlibStream:
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        if not self.decompressor.eof:
+            raise ValueError("gzip stream is truncated")
+        return self.decompressor.flush()
+
+
+class _LzmaStream:
+    def __init__(self):
+        self.decompressor = lzma.LZMADecompressor()
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        if not self.decompressor.eof:
+            raise ValueError("xz stream is truncated")
+        return b""
+
+
+class _ZstdStream:
+    def __init__(self):
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        return self.decompressor.flush()
+
+
+def decompressor(compression_format):
+    """Streaming decompressor with decompress(data) and flush() methods."""
+    if compression_format == "gzip":
+        return _ZlibStream()
+    if compression_format == "xz":
+        return _LzmaStream()
+    if compression_format == "zstd" and zstandard is not None:
+        return _ZstdStream()
+    raise ValueError(f"Unsupported compression format: {compression_format}")
+
+
+def compress_file(src_path, dst_path, compression_format):
+    """Compress src_path into dst_path (written atomically), return its size."""
+    temp_path = dst_path + ".tmp"
+    if compression_format == "gzip":
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compression_format == "xz":
+        compressor = lzma.LZMACompressor(preset=6)
+    elif compression_format == "zstd" and zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=19).compressobj()
+    else:
+        raise ValueError(f"Unsupported compression format: {compression_format}")
+    with open(src_path, "rb") as src, open(temp_path, "wb") as dst:
+        while block := src.read(BLOCK):
+            dst.write(compressor.compress(block))
+        dst.write(compressor.flush())
+    os.replace(temp_path, dst_path)
+    return os.path.getsize(dst_path)
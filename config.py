@@ -9,14 +9,63 @@ exe_name = "_TheSeed.exe"
 config_exe_name = "./" + "config.exe"
 pack_path = "pack"
 version_file_name = "version.pkl" # DO NOT TOUCH
+state_file_name = "filestate.pkl" # DO NOT TOUCH (size/mtime of already verified files)
+patchlist_cache_file = "patchlist.cache" # DO NOT TOUCH (last patchlist, for conditional requests)
+staging_folder = "update.tmp" # DO NOT TOUCH (new files wait here until the whole update has arrived)
+force_full_verify = False # True to re-hash every file at startup (also: start with --full-verify)
+verify_tier = "sample" # launch check: "size", "sample" (size + a few hashed blocks) or "full" (start with --repair for a full check)
+sample_random_count = 4 # random blocks checked by the "sample" tier, besides head and tail
 arguments = "DAMnJDABJd"
 updater_patch = "worker.exe" # DO NOT TOUCH (is autopatcher for autopatcher)
 auto_updater = True # True if u wanna start check at startup
+startup_report = False # print how long each startup step takes (also: start with --startup-report)
+
+### Download ###
+download_workers = 4 # how many files are downloaded at the same time (1 = one by one)
+download_order = "patchlist" # "patchlist", "smallest" or "priority" (files marked "required" always go first)
+exe_order = "last" # "first" or "last": when exe files are downloaded
+bandwidth_limit = 0 # max download speed of the patcher in KB/s (0 = unlimited)
+http_pool_connections = 4 # how many hosts keep a pool of open connections
+http_pool_maxsize = 8 # open connections kept per host (keep >= download_workers)
+http_connect_timeout = 10 # seconds
+http_read_timeout = 30 # seconds without data before a download fails
+download_chunk_size = 64 * 1024 # bytes read from the network in one go
+download_checkpoint_size = 8 * 1024 * 1024 # save resume progress every N bytes
+progress_interval = 0.1 # seconds between two progress bar updates
+download_retries = 2 # extra attempts for a file that fails or arrives corrupted
+segment_min_size = 32 * 1024 * 1024 # files at least this big are downloaded over several connections (0 = never)
+segment_connections = 2 # connections a big file starts with
+segment_max_connections = 8 # more are added up to this while the speed keeps improving
+segment_size = 4 * 1024 * 1024 # size of the first ranges; later ones last about segment_seconds each
+segment_seconds = 2 # target duration of one range request
+use_deltas = True # patch changed files with small binary deltas when the patchlist has them
+use_compression = True # download the compressed copy of a file when the patchlist has one
+use_chunks = True # rebuild changed files from local chunks when the patchlist has chunk lists
+chunk_merge_gap = 256 * 1024 # missing chunks closer than this are fetched in one request
+chunk_local_max_size = 16 * 1024 * 1024 # bigger local files are not chunked on the client (slow in pure Python): delta or full download instead
+
+### Hashing ###
+storage_type = "auto" # "auto", "ssd" or "hdd" (disk that holds the client)
+hash_workers_ssd = 0 # files hashed at the same time on SSD (0 = one per CPU core, max 8)
+hash_workers_hdd = 1 # files hashed at the same time on spinning disks
+hash_block_size = 1024 * 1024 # bytes given to sha256 in one go
+hash_mmap_threshold = 16 * 1024 * 1024 # files bigger than this are memory-mapped
+
+### Metrics ###
+metrics_log_file = "metrics.log" # per-file and per-run timings, one JSON object per line ("" = off)
+metrics_log_max_bytes = 1024 * 1024 # the log is rotated past this size
+metrics_log_backups = 3 # rotated logs kept
+metrics_port = 0 # serve the latest metrics on http://127.0.0.1:<port>/metrics (0 = off)
+
 ### Link ###
 patcher_folder = "https://www.theseedpatcher.it/patcher/"
 patcher_url = patcher_folder + patcher_name # DO NOT TOUCH
 patchlist_url = "http://www.theseedpatcher.it/patcher/patchlist.json"
 pack_url = "http://www.theseedpatcher.it/pack"
+pack_mirrors = [] # other servers with a copy of the pack folder, e.g. ["https://cdn2.example.com/pack"] (the patchlist can add more in "mirrors")
+patchlist_mirrors = [] # other urls of patchlist.json, tried in order when patchlist_url does not answer
+mirror_probe_timeout = 3 # seconds a mirror has to answer the speed test
+mirror_max_failures = 2 # failed files in a row before a mirror is no longer used
 register_url = "https://www.theseedpatcher.it/register.html"
 
 ### Image ###
@@ -49,4 +98,6 @@ Made By Pcb.Is.Good<br><br>
 <a href="https://www.example.com">Click here</a>"""
 
 update_complete = "Update completed"
+update_failed = "Update not finished, press start to resume"
+launch_ready_text = "Ready to play, still updating"
 downloading_text = "Downloading"
\ No newline at end of file
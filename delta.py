@@ -0,0 +1,268 @@
+"""Binary deltas between two versions of a pack file.
+
+A delta is an lzma stream of COPY (offset, length from the old file) and
+DATA (literal bytes) operations, built with an rsync style rolling checksum
+so that inserted or removed bytes do not break the match of what follows.
+
+Server side, build deltas between two pack snapshots:
+
+    python delta.py OLD_PACK NEW_PACK OUT_DIR [--patchlist patchlist.json]
+"""
+import argparse
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import hashing
+
+
+MAGIC = b"APDELTA1"
+BLOCK_SIZE = 16 * 1024
+ADLER_MOD = 65521
+OP_COPY = b"C"
+OP_DATA = b"D"
+OP_END = b"E"
+COPY_STRUCT = struct.Struct(">QQ")
+LENGTH_STRUCT = struct.Struct(">Q")
+IO_BLOCK = 1024 * 1024
+
+
+class DeltaError(Exception):
+    pass
+
+
+def delta_name(file_name, source_hash, target_hash):
+    """Relative path of the delta that turns source_hash into target_hash."""
+    return f"deltas/{file_name}.{source_hash[:16]}-{target_hash[:16]}.apd"
+
+
+class _DeltaWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.copy_offset = None
+        self.copy_length = 0
+
+    def copy(self, offset, length):
+        # Unisci le copie contigue in un'unica operazione
+        if self.copy_offset is not None and self.copy_offset + self.copy_length == offset:
+            self.copy_length += length
+            return
+        self.flush_copy()
+        self.copy_offset, self.copy_length = offset, length
+
+    def data(self, payload):
+        if not payload:
+            return
+        self.flush_copy()
+        self.stream.write(OP_DATA + LENGTH_STRUCT.pack(len(payload)))
+        self.stream.write(payload)
+
+    def flush_copy(self):
+        if self.copy_offset is not None:
+            self.stream.write(OP_COPY + COPY_STRUCT.pack(self.copy_offset, self.copy_length))
+            self.copy_offset, self.copy_length = None, 0
+
+    def close(self):
+        self.flush_copy()
+        self.stream.write(OP_END)
+
+
+def _map(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def make_delta(old_path, new_path, delta_path, block_size=BLOCK_SIZE):
+    """Write a delta that rebuilds new_path from old_path, return its size."""
+    with open(old_path, "rb") as old_file, open(new_path, "rb") as new_file:
+        old, new = _map(old_file), _map(new_file)
+        try:
+            with lzma.open(delta_path, "wb", preset=6) as stream:
+                stream.write(MAGIC)
+                writer = _DeltaWriter(stream)
+                _diff(old, new, block_size, writer)
+                writer.close()
+        finally:
+            for mapped in (old, new):
+                if isinstance(mapped, mmap.mmap):
+                    mapped.close()
+    return os.path.getsize(delta_path)
+
+
+def _diff(old, new, block_size, writer):
+    old_len, new_len = len(old), len(new)
+    index = {}
+    for start in range(0, old_len - block_size + 1, block_size):
+        weak = zlib.adler32(old[start : start + block_size])
+        index.setdefault(weak, []).append(start)
+
+    literal_start = 0
+    pos = 0
+    if not index or new_len < block_size:
+        writer.data(new[:])
+        return
+
+    weak = zlib.adler32(new[0:block_size])
+    a, b = weak & 0xFFFF, weak >> 16
+    while pos + block_size <= new_len:
+        match = None
+        for candidate in index.get((b << 16) | a, ()):
+            if old[candidate : candidate + block_size] == new[pos : pos + block_size]:
+                match = candidate
+                break
+
+        if match is not None:
+            writer.data(new[literal_start:pos])
+            length = block_size
+            # Estendi la copia finche i blocchi successivi coincidono
+            while (
+                match + length + block_size <= old_len
+                and pos + length + block_size <= new_len
+                and old[match + length : match + length + block_size]
+                == new[pos + length : pos + length + block_size]
+            ):
+                length += block_size
+            writer.copy(match, length)
+            pos += length
+            literal_start = pos
+            if pos + block_size <= new_len:
+                weak = zlib.adler32(new[pos : pos + block_size])
+                a, b = weak & 0xFFFF, weak >> 16
+            continue
+
+        if pos + block_size >= new_len:
+            break
+        # Sposta la finestra di un byte aggiornando il checksum (Adler-32 rolling)
+        out_byte, in_byte = new[pos], new[pos + block_size]
+        a = (a - out_byte + in_byte) % ADLER_MOD
+        b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+        pos += 1
+        if pos - literal_start >= IO_BLOCK:
+            writer.data(new[literal_start:pos])
+            literal_start = pos
+
+    writer.data(new[literal_start:new_len])
+
+
+def apply_delta(old_path, delta_path, out_path):
+    """Rebuild a file from old_path and a delta, return the sha256 of the result."""
+    h = hashlib.sha256()
+    with open(old_path, "rb") as old, lzma.open(delta_path, "rb") as stream, open(
+        out_path, "wb"
+    ) as out:
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise DeltaError(f"{delta_path} is not a delta file")
+        while True:
+            op = stream.read(1)
+            if op == OP_END:
+                break
+            if op == OP_COPY:
+                offset, length = COPY_STRUCT.unpack(_read_exact(stream, COPY_STRUCT.size))
+                old.seek(offset)
+                while length:
+                    block = old.read(min(length, IO_BLOCK))
+                    if not block:
+                        raise DeltaError(f"{delta_path} copies past the end of {old_path}")
+                    out.write(block)
+                    h.update(block)
+                    length -= len(block)
+            elif op == OP_DATA:
+                (length,) = LENGTH_STRUCT.unpack(_read_exact(stream, LENGTH_STRUCT.size))
+                while length:
+                    block = _read_exact(stream, min(length, IO_BLOCK))
+                    out.write(block)
+                    h.update(block)
+                    length -= len(block)
+            else:
+                raise DeltaError(f"{delta_path} is truncated or corrupted")
+        out.flush()
+        os.fsync(out.fileno())
+    return h.hexdigest()
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise DeltaError("Unexpected end of delta")
+    return data
+
+
+def build_deltas(old_dir, new_dir, out_dir, max_ratio=0.5, hash_of=hashing.hash_file):
+    """Create deltas for every file changed between two pack folders.
+
+    Returns {file name: {source hash: delta entry}} ready to be merged into
+    the "deltas" field of the patchlist entries. Deltas bigger than max_ratio
+    of the new file are dropped, a full download is cheaper at that point.
+    Deltas already present in out_dir are reused.
+    """
+    deltas = {}
+    for name in sorted(os.listdir(new_dir)):
+        old_path = os.path.join(old_dir, name)
+        new_path = os.path.join(new_dir, name)
+        if not os.path.isfile(new_path) or not os.path.isfile(old_path):
+            continue
+        old_hash, new_hash = hash_of(old_path), hash_of(new_path)
+        if old_hash == new_hash:
+            continue
+        relative = delta_name(name, old_hash, new_hash)
+        delta_path = os.path.join(out_dir, *relative.split("/"))
+        if os.path.exists(delta_path):
+            size = os.path.getsize(delta_path)
+        else:
+            os.makedirs(os.path.dirname(delta_path), exist_ok=True)
+            size = make_delta(old_path, new_path, delta_path)
+            print(f"{name}: delta {size} bytes")
+        if size > os.path.getsize(new_path) * max_ratio:
+            print(f"{name}: delta too big ({size} bytes), skipped")
+            continue
+        deltas[name] = {
+            old_hash: {"file": relative, "hash": hash_of(delta_path), "size": size}
+        }
+    return deltas
+
+
+def merge_into_patchlist(patchlist, deltas, patch_key):
+    """Add delta entries to the files of patch_key, keeping older source versions."""
+    for patch in patchlist[patch_key]:
+        for file, file_info in patch.items():
+            if file in deltas:
+                file_info.setdefault("deltas", {}).update(deltas[file])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build binary deltas between two pack folders.")
+    parser.add_argument("old_pack", help="pack folder of the version players have")
+    parser.add_argument("new_pack", help="pack folder of the new version")
+    parser.add_argument("out_dir", help="folder served as pack_url, deltas go in out_dir/deltas")
+    parser.add_argument("--patchlist", help="patchlist.json to update with the new deltas")
+    parser.add_argument("--max-ratio", type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    deltas = build_deltas(args.old_pack, args.new_pack, args.out_dir, args.max_ratio)
+    if not args.patchlist:
+        print(json.dumps(deltas, indent=2))
+        return 0
+
+    with open(args.patchlist, "r", encoding="utf-8") as f:
+        patchlist = json.load(f)
+    patch_keys = [key for key in patchlist if key.startswith("patch_")]
+    if not patch_keys:
+        print("No patch key found in the patchlist.")
+        return 1
+    patch_key = max(patch_keys, key=lambda x: float(x.split("_")[1]))
+    merge_into_patchlist(patchlist, deltas, patch_key)
+    temp_path = args.patchlist + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(patchlist, f, indent=4)
+    os.replace(temp_path, args.patchlist)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
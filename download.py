@@ -0,0 +1,538 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import compression
+import config
+import hashing
+import scheduler
+import transport
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    pass
+
+
+def part_paths(local_path):
+    """Paths of the partial file and of its progress metadata."""
+    return local_path + ".part", local_path + ".part.json"
+
+
+def load_part_meta(meta_path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_part_meta(meta_path, meta):
+    """Write the metadata next to the partial file, replacing it atomically."""
+    temp_path = meta_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, meta_path)
+
+
+def discard_part(local_path):
+    for path in part_paths(local_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def resume_offset(local_path, url, expected_hash, expected_size):
+    """Bytes already downloaded for this exact file, or 0 to start over."""
+    part_path, meta_path = part_paths(local_path)
+    meta = load_part_meta(meta_path)
+    if (
+        meta is None
+        # Con l'hash si puo riprendere anche da un altro mirror: il controllo finale decide
+        or (meta.get("url") != url and expected_hash is None)
+        or meta.get("hash") != expected_hash
+        or meta.get("size") != expected_size
+        or not os.path.exists(part_path)
+    ):
+        discard_part(local_path)
+        return 0, {}
+    offset = min(meta.get("offset", 0), os.path.getsize(part_path))
+    # Quello che sta oltre l'ultimo checkpoint potrebbe non essere mai arrivato su disco
+    with open(part_path, "r+b") as f:
+        f.truncate(offset)
+    return offset, meta
+
+
+def download_to_file(
+    url,
+    local_path,
+    expected_hash=None,
+    expected_size=None,
+    on_progress=None,
+    should_continue=None,
+    compression_format=None,
+    transfer_size=None,
+    stats=None,
+):
+    """Stream url into a .part file next to local_path, resuming with a Range request.
+
+    Every chunk is hashed as it arrives and the result is checked against
+    expected_hash before the file is renamed over local_path, so the file never
+    has to be read back. Failed or corrupt transfers are retried
+    config.download_retries times. Returns False if should_continue() asked to
+    stop; the partial file is kept so the next call resumes where this one ended.
+
+    With compression_format, url serves a compressed copy of transfer_size
+    bytes that is decompressed on the fly; progress counts compressed bytes
+    and the hash is checked on the decompressed file. Compressed transfers
+    cannot resume and restart from the beginning.
+
+    Files of config.segment_min_size bytes or more are fetched by
+    SegmentedDownload over several connections when the server accepts Range.
+
+    If given, the stats dict is filled with the metrics of the transfer:
+    retries, connect_time, ttfb, bytes_received, bytes_hashed and hash_time.
+    """
+    stats = {} if stats is None else stats
+    attempts = max(0, config.download_retries) + 1
+    for attempt in range(1, attempts + 1):
+        stats["retries"] = attempt - 1
+        try:
+            return _download_once(
+                url,
+                local_path,
+                expected_hash,
+                expected_size,
+                on_progress,
+                should_continue,
+                compression_format,
+                transfer_size,
+                stats,
+            )
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            print(f"Retrying {url} ({attempt}/{attempts - 1}): {e}")
+
+
+def _download_once(
+    url,
+    local_path,
+    expected_hash,
+    expected_size,
+    on_progress,
+    should_continue,
+    compression_format,
+    transfer_size,
+    stats,
+):
+    part_path, meta_path = part_paths(local_path)
+    if use_segments(expected_hash, expected_size, compression_format, meta_path):
+        try:
+            return SegmentedDownload(
+                url, local_path, expected_hash, expected_size, on_progress, should_continue, stats
+            ).run()
+        except RangeNotSupported:
+            discard_part(local_path)  # il server non accetta Range: un solo flusso
+    if compression_format:
+        discard_part(local_path)
+        offset, meta = 0, {}
+    else:
+        offset, meta = resume_offset(local_path, url, expected_hash, expected_size)
+    hasher = None
+    if expected_hash is not None:
+        started = time.perf_counter()
+        hasher = hashing.hash_prefix(part_path, offset) if offset else hashlib.sha256()
+        add_stat(stats, "hash_time", time.perf_counter() - started)
+        add_stat(stats, "bytes_hashed", offset)
+
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        validator = meta.get("etag") or meta.get("last_modified")
+        if validator and meta.get("url") == url:
+            # Se il file sul server e cambiato riceviamo 200 e ripartiamo da zero
+            headers["If-Range"] = validator
+
+    if expected_size == 0 and not compression_format and not os.path.exists(part_path):
+        # File vuoto: niente da scaricare, ma il .part serve per verifica e rename
+        open(part_path, "wb").close()
+    if expected_size is None or offset < expected_size or compression_format:
+        with transport.get(url, stream=True, headers=headers) as response:
+            connect_time, ttfb = transport.last_timing()
+            add_stat(stats, "connect_time", connect_time)
+            stats["ttfb"] = ttfb
+            if response.status_code == 416 and offset:
+                # Il server non ha altro da darci: il file parziale e gia completo
+                pass
+            else:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0
+                    if hasher is not None:
+                        hasher = hashlib.sha256()
+                meta = {
+                    "url": url,
+                    "hash": expected_hash,
+                    "size": expected_size,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "offset": offset,
+                }
+                if compression_format:
+                    completed = _write_compressed_stream(
+                        response,
+                        part_path,
+                        compression.decompressor(compression_format),
+                        hasher,
+                        transfer_size,
+                        on_progress,
+                        should_continue,
+                        stats,
+                    )
+                else:
+                    save_part_meta(meta_path, meta)
+                    completed = _write_stream(
+                        response,
+                        part_path,
+                        meta_path,
+                        meta,
+                        hasher,
+                        on_progress,
+                        should_continue,
+                        stats,
+                    )
+                if not completed:
+                    return False
+
+    if expected_size is not None and os.path.getsize(part_path) != expected_size:
+        discard_part(local_path)
+        raise DownloadError(f"Size mismatch for {url}")
+    if hasher is not None and hasher.hexdigest() != expected_hash.lower():
+        discard_part(local_path)
+        raise DownloadError(f"Hash mismatch for {url}")
+
+    os.replace(part_path, local_path)
+    discard_part(local_path)
+    return True
+
+
+def _write_stream(
+    response, part_path, meta_path, meta, hasher, on_progress, should_continue, stats
+):
+    """Append the response body to the partial file, hashing and checkpointing it."""
+    downloaded = meta["offset"]
+    checkpoint = downloaded
+    total = meta["size"]
+    mode = "ab" if downloaded else "wb"
+    with open(part_path, mode) as file:
+        for chunk in response.iter_content(chunk_size=config.download_chunk_size):
+            if should_continue is not None and not should_continue():
+                _checkpoint(file, meta_path, meta, downloaded)
+                return False
+            if chunk:
+                scheduler.bandwidth.consume(len(chunk))
+                file.write(chunk)
+                if hasher is not None:
+                    started = time.perf_counter()
+                    hasher.update(chunk)
+                    add_stat(stats, "hash_time", time.perf_counter() - started)
+                    add_stat(stats, "bytes_hashed", len(chunk))
+                add_stat(stats, "bytes_received", len(chunk))
+                downloaded += len(chunk)
+                if downloaded - checkpoint >= config.download_checkpoint_size:
+                    _checkpoint(file, meta_path, meta, downloaded)
+                    checkpoint = downloaded
+                if on_progress is not None:
+                    on_progress(downloaded, total)
+        _checkpoint(file, meta_path, meta, downloaded)
+    return True
+
+
+def _write_compressed_stream(
+    response, part_path, stream, hasher, transfer_size, on_progress, should_continue, stats
+):
+    """Decompress the response body into the partial file, hashing what is written."""
+    received = 0
+    with open(part_path, "wb") as file:
+        for chunk in response.iter_content(chunk_size=config.download_chunk_size):
+            if should_continue is not None and not should_continue():
+                return False
+            if chunk:
+                scheduler.bandwidth.consume(len(chunk))
+                data = stream.decompress(chunk)
+                file.write(data)
+                if hasher is not None:
+                    started = time.perf_counter()
+                    hasher.update(data)
+                    add_stat(stats, "hash_time", time.perf_counter() - started)
+                    add_stat(stats, "bytes_hashed", len(data))
+                add_stat(stats, "bytes_received", len(chunk))
+                received += len(chunk)
+                if on_progress is not None:
+                    on_progress(received, transfer_size)
+        data = stream.flush()
+        file.write(data)
+        if hasher is not None:
+            hasher.update(data)
+            add_stat(stats, "bytes_hashed", len(data))
+        file.flush()
+        os.fsync(file.fileno())
+    return True
+
+
+def use_segments(expected_hash, expected_size, compression_format, meta_path):
+    """Big files go over several connections, unless a single-stream .part is pending."""
+    if (
+        not config.segment_min_size
+        or compression_format
+        or expected_hash is None
+        or expected_size is None
+        or expected_size < config.segment_min_size
+    ):
+        return False
+    meta = load_part_meta(meta_path)
+    return meta is None or "segments" in meta or not meta.get("offset")
+
+
+class SegmentedDownload:
+    """Fetch one file as byte ranges over several connections into a preallocated .part.
+
+    Each connection takes the next range, about config.segment_seconds of
+    transfer at the speed measured so far, and writes it at its offset.
+    Connections are added up to config.segment_max_connections while the
+    total speed keeps improving. Finished ranges are saved in the .part.json,
+    so a stopped download resumes them; the hash is checked on the whole file
+    at the end.
+    """
+
+    def __init__(self, url, local_path, expected_hash, size, on_progress, should_continue, stats):
+        self.url = url
+        self.local_path = local_path
+        self.part_path, self.meta_path = part_paths(local_path)
+        self.expected_hash = expected_hash
+        self.size = size
+        self.on_progress = on_progress
+        self.should_continue = should_continue
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.segment_size = config.segment_size
+        self.done = []  # intervalli [start, end) gia su disco
+        self.gaps = []  # intervalli ancora da scaricare
+        self.downloaded = 0
+        self.unsaved = 0
+        self.errors = 0
+        self.error = None
+        self.stopped = False
+        self.meta = None
+
+    def run(self):
+        """True once the file is in place; False if should_continue() asked to stop."""
+        self.prepare()
+        threads = [self.start_worker() for _ in range(max(1, config.segment_connections))]
+        last_check, last_bytes, best_speed = time.perf_counter(), self.downloaded, 0.0
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.05)
+            now = time.perf_counter()
+            if now - last_check < config.segment_seconds:
+                continue
+            with self.lock:
+                speed = (self.downloaded - last_bytes) / (now - last_check)
+                last_bytes = self.downloaded
+                pending = bool(self.gaps) and self.error is None and not self.stopped
+            alive = sum(thread.is_alive() for thread in threads)
+            # Un'altra connessione finche la velocita totale cresce di almeno il 10%
+            if pending and speed > best_speed * 1.1 and alive < config.segment_max_connections:
+                threads.append(self.start_worker())
+            last_check, best_speed = now, max(best_speed, speed)
+
+        self.save_meta()
+        if self.error is not None:
+            raise self.error
+        if self.stopped:
+            return False
+        return self.finish()
+
+    def prepare(self):
+        meta = load_part_meta(self.meta_path)
+        if (
+            meta is not None
+            and "segments" in meta
+            and meta.get("hash") == self.expected_hash
+            and meta.get("size") == self.size
+            and os.path.exists(self.part_path)
+            and os.path.getsize(self.part_path) == self.size
+        ):
+            self.done = [list(segment) for segment in meta["segments"]]
+        else:
+            discard_part(self.local_path)
+            with open(self.part_path, "wb") as f:
+                f.truncate(self.size)  # file preallocato, ogni segmento scrive al suo posto
+        self.meta = {"url": self.url, "hash": self.expected_hash, "size": self.size, "segments": self.done}
+        self.downloaded = sum(end - start for start, end in self.done)
+        position = 0
+        for start, end in sorted(self.done):
+            if start > position:
+                self.gaps.append([position, start])
+            position = max(position, end)
+        if position < self.size:
+            self.gaps.append([position, self.size])
+        self.save_meta()
+
+    def start_worker(self):
+        thread = threading.Thread(target=self.worker, daemon=True)
+        thread.start()
+        return thread
+
+    def next_segment(self):
+        with self.lock:
+            if not self.gaps or self.error is not None or self.stopped:
+                return None
+            gap = self.gaps[0]
+            start = gap[0]
+            end = min(gap[1], start + self.segment_size)
+            gap[0] = end
+            if gap[0] >= gap[1]:
+                self.gaps.pop(0)
+            return start, end
+
+    def worker(self):
+        with open(self.part_path, "r+b") as file:
+            while True:
+                segment = self.next_segment()
+                if segment is None:
+                    return
+                try:
+                    self.fetch_segment(file, *segment)
+                except RangeNotSupported as e:
+                    self.fail(e)
+                    return
+                except Exception as e:
+                    with self.lock:
+                        self.errors += 1
+                        add_stat(self.stats, "retries", 1)
+                        if self.errors > config.download_retries:
+                            self.error = e
+
+    def fetch_segment(self, file, start, end):
+        """Write bytes start..end-1 at their offset; what is missing goes back in the queue."""
+        written = 0
+        segment_started = time.perf_counter()
+        try:
+            with transport.get(
+                self.url, stream=True, headers={"Range": f"bytes={start}-{end - 1}"}
+            ) as response:
+                connect_time, ttfb = transport.last_timing()
+                add_stat(self.stats, "connect_time", connect_time)
+                self.stats.setdefault("ttfb", ttfb)
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RangeNotSupported(f"{self.url} does not support Range requests")
+                file.seek(start)
+                for chunk in response.iter_content(chunk_size=config.download_chunk_size):
+                    if self.should_continue is not None and not self.should_continue():
+                        with self.lock:
+                            self.stopped = True
+                        return
+                    if not chunk:
+                        continue
+                    chunk = chunk[: end - start - written]
+                    scheduler.bandwidth.consume(len(chunk))
+                    file.write(chunk)
+                    written += len(chunk)
+                    self.progress(len(chunk))
+                    if written >= end - start:
+                        break
+            if written < end - start:
+                raise DownloadError(f"short Range response from {self.url}")
+            self.adapt(written, time.perf_counter() - segment_started)
+        finally:
+            self.record(file, start, start + written)
+            self.retry_later(start + written, end)
+
+    def adapt(self, written, seconds):
+        """Size the next segments to about config.segment_seconds at this connection's speed."""
+        if seconds <= 0:
+            return
+        size = int(written / seconds * config.segment_seconds)
+        with self.lock:
+            self.segment_size = max(
+                config.segment_size // 4, min(size, config.segment_size * 8)
+            )
+
+    def progress(self, amount):
+        with self.lock:
+            self.downloaded += amount
+            downloaded = self.downloaded
+            add_stat(self.stats, "bytes_received", amount)
+        if self.on_progress is not None:
+            self.on_progress(downloaded, self.size)
+
+    def record(self, file, start, end):
+        """Mark start..end as on disk; the .part.json is updated every checkpoint."""
+        if end <= start:
+            return
+        file.flush()
+        os.fsync(file.fileno())
+        with self.lock:
+            self.done.append([start, end])
+            self.unsaved += end - start
+            if self.unsaved < config.download_checkpoint_size:
+                return
+            self.unsaved = 0
+        self.save_meta()
+
+    def retry_later(self, start, end):
+        if end > start:
+            with self.lock:
+                self.gaps.insert(0, [start, end])
+
+    def fail(self, error):
+        with self.lock:
+            self.error = error
+
+    def save_meta(self):
+        with self.lock:
+            meta = dict(self.meta, segments=merge_ranges(self.done))
+        save_part_meta(self.meta_path, meta)
+
+    def finish(self):
+        started = time.perf_counter()
+        file_hash = hashing.hash_file(self.part_path)
+        add_stat(self.stats, "hash_time", time.perf_counter() - started)
+        add_stat(self.stats, "bytes_hashed", self.size)
+        if file_hash != self.expected_hash.lower():
+            discard_part(self.local_path)
+            raise DownloadError(f"Hash mismatch for {self.url}")
+        os.replace(self.part_path, self.local_path)
+        discard_part(self.local_path)
+        return True
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def add_stat(stats, key, value):
+    stats[key] = stats.get(key, 0) + value
+
+
+def _checkpoint(file, meta_path, meta, downloaded):
+    file.flush()
+    os.fsync(file.fileno())
+    meta["offset"] = downloaded
+    save_part_meta(meta_path, meta)
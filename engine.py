@@ -0,0 +1,757 @@
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import chunks
+import compression
+import config
+import delta
+import download
+import hashing
+import metrics
+import mirrors
+import patchlist_cache
+import scheduler
+import startup
+from plan import PlannedFile, UpdatePlan
+from progress import ProgressAggregator
+from state import FileStateIndex
+import transaction
+from transaction import UpdateTransaction
+
+
+def read_client_version(version_file=config.version_file_name):
+    """Version stored by the last update, creating the file on first run."""
+    if not os.path.exists(version_file):
+        with open(version_file, "wb") as f:
+            pickle.dump("1.0", f)
+        return "1.0"
+    with open(version_file, "rb") as f:
+        return pickle.load(f)
+
+
+class UpdateEngine:
+    """Reconcile and download logic, free of any GUI toolkit.
+
+    Progress is reported through listener(event, *args), called from the
+    worker threads. Events:
+        progress_changed(percent, text)      reconcile progress
+        file_downloading(file_name)          a transfer starts
+        transfer_progress(percent, file_name, bytes_per_second, eta_seconds)
+        launch_ready()                       every "required" file is in place
+        failed(text)                         some files did not arrive, nothing committed
+        finished()                           the update is over
+
+    New files are staged and journaled by an UpdateTransaction; they replace
+    the client files, and the version file is written, only once every file
+    of the version has arrived.
+    """
+
+    def __init__(
+        self,
+        client_version,
+        patchlist_url,
+        pack_url,
+        pack_path,
+        exe_folder,
+        force_full_verify=config.force_full_verify,
+        verify_tier=config.verify_tier,
+        listener=None,
+    ):
+        self.client_version = client_version
+        self.patchlist_url = patchlist_url
+        self.pack_url = pack_url
+        self.pack_path = pack_path
+        self.exe_folder = exe_folder
+        self.force_full_verify = force_full_verify
+        self.verify_tier = verify_tier
+        self.listener = listener
+        self.file_state = FileStateIndex()
+        self.chunk_index = {}
+        self.progress = None
+        self.patchlist_validator = None
+        self.patchlist_unchanged = False
+        self.metrics = None
+        self.mirrors = mirrors.MirrorPool([pack_url])
+        self.transaction = None
+        self.running = True
+
+    def emit(self, event, *args):
+        if self.listener is not None:
+            self.listener(event, *args)
+
+    def run(self):
+        """Run a whole update; True once the client matches the server version."""
+        self.metrics = metrics.RunMetrics("update")
+        metrics.serve()
+        status = "failed"
+        try:
+            with self.metrics.phase("finalize"):
+                self.recover_transaction()
+            with self.metrics.phase("fetch_manifest"):
+                patchlist = self.download_patchlist(self.patchlist_url)
+            if not patchlist or not self.running:
+                if self.running:
+                    self.emit("failed", config.update_failed)
+                else:
+                    status = "stopped"
+                return False
+            patch_key = self.get_patch_key(patchlist)
+            if not patch_key:
+                print("No valid patch key found in the patchlist.")
+                self.emit("failed", config.update_failed)
+                return False
+            self.mirrors = mirrors.MirrorPool(
+                [self.pack_url] + config.pack_mirrors + patchlist.get("mirrors", [])
+            )
+
+            server_version = patch_key
+            if self.client_version == server_version:
+                with self.metrics.phase("reconcile"):
+                    reconciled = self.patchlist_unchanged and self.is_reconciled(
+                        patchlist, patch_key
+                    )
+                if reconciled:
+                    # 304 e nessun file toccato dall'ultimo controllo: niente da fare
+                    status = "up_to_date"
+                    self.emit("finished")
+                    return True
+
+            if transaction.pending():
+                # Aggiornamento interrotto: i file gia nella staging non si riverificano
+                self.transaction = UpdateTransaction(server_version)
+            with self.metrics.phase("reconcile"):
+                plan = self.build_plan(patchlist, patch_key)
+                self.file_state.save()
+            if not self.running:
+                status = "stopped"
+                return False
+            if plan.is_empty() and self.client_version == server_version:
+                if self.transaction is not None:
+                    self.transaction.close()
+                    self.transaction = None
+                self.file_state.set_meta("reconciled_patchlist", self.patchlist_validator)
+                status = "up_to_date"
+                self.emit("finished")
+                return True
+
+            with self.metrics.phase("download"):
+                complete = self.apply_plan(plan)
+            if not self.running:
+                status = "stopped"
+                return False
+            if not complete:
+                # I file arrivati restano nella staging: il prossimo avvio riparte da li
+                status = "incomplete"
+                self.emit("failed", config.update_failed)
+                return False
+            with self.metrics.phase("finalize"):
+                self.transaction.commit(plan.to_fetch, plan.to_delete, final=True)
+                for entry in plan.to_fetch:
+                    self.file_state.record(
+                        entry.local_path, entry.file_info["hash"], entry.file_info.get("chunks")
+                    )
+                self.finish_transaction()
+            status = "complete"
+            self.emit("finished")
+            return True
+        except Exception as e:
+            print(f"Error during update: {e}")
+            self.emit("failed", config.update_failed)
+            return False
+        finally:
+            with self.metrics.phase("finalize"):
+                self.file_state.save()
+            if startup.marks:
+                self.metrics.fields["startup"] = startup.report()
+            self.metrics.finish(status)
+
+    def recover_transaction(self):
+        """Finish the swap of an update interrupted after its files all arrived.
+
+        Commits journaled before a crash are replayed; when the last one was
+        final the update is complete and only the version file was missing.
+        """
+        if not transaction.pending():
+            return
+        interrupted = UpdateTransaction()
+        if interrupted.version is None:
+            return
+        try:
+            interrupted.replay()
+        except Exception as e:
+            print(f"Error resuming the interrupted update: {e}")
+            return
+        if interrupted.final:
+            print(f"Completing interrupted update to {interrupted.version}")
+            for record in interrupted.committed_records():
+                self.file_state.record(record["target"], record["hash"])
+            self.transaction = interrupted
+            self.finish_transaction()
+
+    def finish_transaction(self):
+        """Delete removed files, write the version and drop the staging folder."""
+        self.delete_files(self.transaction.deletes)
+        self.update_version_file(self.transaction.version)
+        self.client_version = self.transaction.version
+        self.transaction.close()
+        self.transaction = None
+
+    def dry_run(self):
+        """Print what an update would do without downloading anything."""
+        plan = self.check()
+        if plan is not None:
+            print(plan.describe())
+        return plan
+
+    def check(self):
+        """Reconcile local files with the server patchlist and return the UpdatePlan."""
+        self.metrics = metrics.RunMetrics("check")
+        plan = None
+        try:
+            with self.metrics.phase("fetch_manifest"):
+                patchlist = self.download_patchlist(self.patchlist_url)
+            patch_key = self.get_patch_key(patchlist) if patchlist else None
+            if not patch_key:
+                print("No valid patch key found in the patchlist.")
+                return None
+            with self.metrics.phase("reconcile"):
+                plan = self.build_plan(patchlist, patch_key)
+                self.file_state.save()
+            return plan
+        finally:
+            self.metrics.finish("failed" if plan is None else "complete")
+
+    def stop(self):
+        self.running = False
+
+    def get_patch_key(self, patchlist):
+        """Find the most recent patch key dynamically."""
+        patch_keys = [key for key in patchlist.keys() if key.startswith("patch_")]
+        if not patch_keys:
+            return None
+
+        patch_keys.sort(key=lambda x: float(x.split("_")[1]), reverse=True)
+        return patch_keys[0]
+
+    def get_changed_files(self, patchlist, patch_key):
+        """Files changed and removed between the client version and patch_key.
+
+        Follows the "from" links of patchlist["history"] back from patch_key to
+        the stored client version, across any number of skipped versions.
+        Returns None when the history does not reach the client version; the
+        caller then has to look at every file.
+        """
+        history = patchlist.get("history", {})
+        changed, removed = set(), set()
+        version = patch_key
+        visited = set()
+        while version != self.client_version:
+            step = history.get(version)
+            if step is None or version in visited:
+                return None
+            visited.add(version)
+            changed.update(step.get("changed", []))
+            removed.update(step.get("removed", []))
+            version = step.get("from")
+
+        current = {file for patch in patchlist[patch_key] for file in patch}
+        current.update(patchlist.get("exe", {}))
+        return changed & current, removed - current
+
+    def delete_files(self, local_paths):
+        """Delete pack files that are no longer part of the client."""
+        for local_path in local_paths:
+            try:
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+                self.file_state.forget(local_path)
+            except Exception as e:
+                print(f"Error removing {local_path}: {e}")
+
+    def download_patchlist(self, patchlist_url):
+        """Download the patchlist file bypassing Cloudflare, reusing the cached copy if unchanged.
+
+        When patchlist_url does not answer, config.patchlist_mirrors are tried in order.
+        """
+        for url in [patchlist_url] + config.patchlist_mirrors:
+            patchlist, validator, unchanged = patchlist_cache.fetch_patchlist(url)
+            if patchlist:
+                break
+        self.patchlist_validator = validator
+        self.patchlist_unchanged = unchanged
+        return patchlist
+
+    def is_reconciled(self, patchlist, patch_key):
+        """True if this patchlist was already checked and no local file changed since."""
+        if self.force_full_verify or self.patchlist_validator is None:
+            return False
+        if self.file_state.get_meta("reconciled_patchlist") != self.patchlist_validator:
+            return False
+        for patch in patchlist[patch_key]:
+            for file, file_info in patch.items():
+                local_path = os.path.join(self.pack_path, file)
+                if not self.file_state.is_verified(local_path, file_info["hash"]):
+                    return False
+        return all(
+            os.path.exists(os.path.join(self.exe_folder, exe))
+            for exe in patchlist.get("exe", [])
+        )
+
+    def build_plan(self, patchlist, patch_key):
+        """Reconcile local files with the patchlist, hashing every file at most once."""
+        plan = UpdatePlan(patch_key)
+        only, removed = None, set()
+        if self.client_version != patch_key:
+            changes = self.get_changed_files(patchlist, patch_key)
+            if changes is not None:
+                only, removed = changes
+        plan.to_delete = [
+            os.path.join(self.pack_path, file)
+            for file in sorted(removed)
+            if os.path.exists(os.path.join(self.pack_path, file))
+        ]
+
+        entries = [
+            PlannedFile(
+                file,
+                os.path.join(self.pack_path, file),
+                file_info,
+            )
+            for patch in patchlist[patch_key]
+            for file, file_info in patch.items()
+            if only is None or file in only
+        ]
+        entries += [
+            PlannedFile(
+                exe,
+                os.path.join(self.exe_folder, exe),
+                file_info,
+                is_exe=True,
+            )
+            for exe, file_info in patchlist.get("exe", {}).items()
+            if only is None or exe in only
+        ]
+        # A versione invariata degli exe basta che esistano
+        exe_hash_check = self.client_version != patch_key
+        # I controlli veloci valgono solo all'avvio: in aggiornamento i file cambiati vanno hashati
+        tier = self.verify_tier
+        if self.force_full_verify or self.client_version != patch_key:
+            tier = "full"
+
+        def reconcile(entry):
+            if self.transaction is not None and self.transaction.is_done(entry):
+                return False  # gia scaricato e verificato nella staging
+            if not os.path.exists(entry.local_path):
+                print(f"Missing file: {entry.local_path}")
+                return False
+            if entry.is_exe and not exe_hash_check:
+                return True
+            if tier != "full" and self.file_state.lookup(entry.local_path) is None:
+                if not self.quick_check(entry.local_path, entry.file_info, tier):
+                    print(f"Quick check failed for {entry.local_path}")
+                    return False
+                return True
+            entry.local_hash = self.local_file_hash(entry.local_path)
+            if entry.local_hash != entry.file_info["hash"]:
+                print(f"Hash mismatch for {entry.local_path}")
+                return False
+            if "chunks" in entry.file_info:
+                self.file_state.remember_chunks(
+                    entry.local_path, entry.local_hash, entry.file_info["chunks"]
+                )
+            return True
+
+        # Inizia il processo di checking dei pacchetti, piu file alla volta
+        workers = hashing.pick_workers(self.pack_path)
+        results = hashing.run_parallel(reconcile, entries, workers)
+        last_emit = 0.0
+        try:
+            for done, (entry, ok) in enumerate(results, 1):
+                if not self.running:
+                    break
+                (plan.up_to_date if ok else plan.to_fetch).append(entry)
+                now = time.monotonic()
+                if now - last_emit >= config.progress_interval or done == len(entries):
+                    last_emit = now
+                    # Aggiungi nome del file al messaggio di progresso
+                    progress = int(done * 100 / len(entries))
+                    self.emit("progress_changed", progress, f"Checking {entry.name}...")
+        finally:
+            results.close()
+        order = {id(entry): index for index, entry in enumerate(entries)}
+        plan.to_fetch.sort(key=lambda entry: order[id(entry)])
+        return plan
+
+    def quick_check(self, file_path, file_info, tier):
+        """Cheap verification: size only, or size plus sampled block hashes."""
+        if os.path.getsize(file_path) != file_info["size"]:
+            return False
+        if tier == "sample" and "samples" in file_info:
+            try:
+                return hashing.check_samples(
+                    file_path, file_info["samples"], config.sample_random_count
+                )
+            except Exception as e:
+                print(f"Error sampling {file_path}: {e}")
+                return False
+        return True
+
+    def local_file_hash(self, file_path):
+        """Hash of a local file, skipping files unchanged since they were last hashed."""
+        if not self.force_full_verify:
+            known_hash = self.file_state.lookup(file_path)
+            if known_hash is not None:
+                return known_hash
+        try:
+            started = time.perf_counter()
+            file_hash = hashing.hash_file(file_path)
+            if self.metrics is not None:
+                self.metrics.hashed(
+                    file_path, os.path.getsize(file_path), time.perf_counter() - started
+                )
+            self.file_state.record(file_path, file_hash)
+            return file_hash
+        except Exception as e:
+            print(f"Error calculating hash for {file_path}: {e}")
+            return None
+
+    def update_version_file(self, version, version_file=config.version_file_name):
+        """Update the version file with the new version."""
+        try:
+            with open(version_file, "wb") as f:
+                pickle.dump(version, f)
+        except Exception as e:
+            print(f"Error updating version file: {e}")
+
+    def apply_plan(self, plan):
+        """Patch or download what the plan lists into the staging folder, group by group.
+
+        Files marked "required" come first; once they are all staged they are
+        swapped in and launch_ready is emitted so the game can start while the
+        rest downloads. Returns True if every file arrived.
+        """
+        if self.transaction is None:
+            self.transaction = UpdateTransaction(plan.version)
+        if plan.to_fetch:
+            self.mirrors.probe(plan.to_fetch[0].name)
+        if config.use_chunks and any("chunks" in e.file_info for e in plan.to_fetch):
+            self.chunk_index = self.build_chunk_index(plan)
+        self.progress = ProgressAggregator(
+            plan.total_bytes,
+            lambda percent, file_name, speed, eta: self.emit(
+                "transfer_progress", percent, file_name, speed, eta
+            ),
+        )
+
+        has_required = any(
+            entry.file_info.get("required") for entry in plan.to_fetch + plan.up_to_date
+        )
+        launch_signalled = False
+        complete = True
+        for group in scheduler.schedule(plan.to_fetch):
+            if has_required and not launch_signalled and not any(
+                entry.file_info.get("required") for entry in group
+            ):
+                required = [e for e in plan.to_fetch if e.file_info.get("required")]
+                self.transaction.commit(required)
+                for entry in required:
+                    self.file_state.record(
+                        entry.local_path, entry.file_info["hash"], entry.file_info.get("chunks")
+                    )
+                self.emit("launch_ready")
+                launch_signalled = True
+            if not self.fetch_group(group, plan.total_bytes):
+                # Un file necessario non e arrivato: niente avvio anticipato
+                launch_signalled = True
+                complete = False
+            if not self.running:
+                return False
+        return complete
+
+    def fetch_group(self, group, total_size):
+        """Fetch a group of files in the worker pool, return True if all succeeded."""
+        workers = max(1, int(config.download_workers))
+        if all(entry.is_exe for entry in group):
+            workers = 1  # gli exe uno alla volta, come prima
+        success = True
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self.fetch_file, entry, total_size) for entry in group
+            ]
+            for future in as_completed(futures):
+                if not self.running:
+                    # Non far partire i download ancora in coda
+                    for pending in futures:
+                        pending.cancel()
+                    return False
+                success = future.result() and success
+        return success
+
+    def set_bandwidth_limit(self, kilobytes_per_second):
+        """Change the download speed limit, also while an update is running."""
+        scheduler.set_bandwidth_limit(kilobytes_per_second)
+
+    def fetch_file(self, entry, total_size):
+        """Stage one planned file: delta, then chunks, then full download."""
+        if not self.running:
+            return False
+        if self.transaction.is_done(entry):
+            self.progress.complete(entry.name, entry.size)
+            return True
+        started = time.perf_counter()
+        ok = False
+        try:
+            ok = self.fetch_file_with_fallbacks(entry, total_size)
+            if ok:
+                self.transaction.mark_done(
+                    entry, os.path.exists(self.transaction.staged_path(entry))
+                )
+            return ok
+        finally:
+            if self.metrics is not None:
+                self.metrics.finish_file(entry.name, ok, time.perf_counter() - started)
+            if self.running:
+                self.progress.complete(entry.name, entry.size)
+
+    def fetch_file_with_fallbacks(self, entry, total_size):
+        """Try a delta, then a chunk rebuild, then the full file; True on success.
+
+        The new file is written to its staging path; the local copy is only read.
+        """
+        staged_path = self.transaction.staged_path(entry)
+        staging_folder = os.path.dirname(staged_path)
+        if staging_folder:
+            os.makedirs(staging_folder, exist_ok=True)
+        if (
+            entry.local_hash is None
+            and entry.file_info.get("deltas")
+            and os.path.exists(entry.local_path)
+        ):
+            # Il controllo veloce non ha letto il file: serve l'hash per scegliere il delta
+            entry.local_hash = self.local_file_hash(entry.local_path)
+        if entry.local_hash == entry.file_info["hash"]:
+            self.note_metrics(entry.name, method="none")
+            return True
+        if entry.local_hash and self.patch_with_delta(
+            entry.local_path, entry.local_hash, entry.file_info, entry.name, staged_path
+        ):
+            return True
+        if self.rebuild_from_chunks(
+            entry.name, entry.local_path, entry.file_info, entry.name, staged_path
+        ):
+            return True
+        return self.download_file(
+            entry.name,
+            staged_path,
+            entry.size,
+            total_size,
+            entry.name,
+            expected_hash=entry.file_info["hash"],
+            compressed=entry.file_info.get("compressed"),
+        )
+
+    def patch_with_delta(self, local_path, local_hash, file_info, file_name, target_path):
+        """Write target_path from the local copy and a binary delta, if one is published."""
+        delta_info = file_info.get("deltas", {}).get(local_hash)
+        if not config.use_deltas or not delta_info or not self.running:
+            return False
+        delta_path = target_path + ".delta"
+        patched_path = target_path + ".patched"
+        try:
+            self.current_file = file_name
+            self.emit("file_downloading", file_name)
+            self.note_metrics(file_name, method="delta")
+            completed = self.fetch_from_mirrors(
+                delta_info["file"],
+                delta_info["size"],
+                file_name,
+                lambda url, stats: download.download_to_file(
+                    url,
+                    delta_path,
+                    expected_hash=delta_info["hash"],
+                    expected_size=delta_info["size"],
+                    on_progress=self.progress_reporter(file_name, file_info["size"]),
+                    should_continue=lambda: self.running,
+                    stats=stats,
+                ),
+            )
+            if not completed:
+                return False
+            if delta.apply_delta(local_path, delta_path, patched_path) != file_info["hash"]:
+                raise delta.DeltaError("patched file does not match the patchlist hash")
+            os.replace(patched_path, target_path)
+            return True
+        except Exception as e:
+            print(f"Delta patch failed for {file_name}, downloading full file: {e}")
+            self.note_metrics(file_name, error=f"delta: {e}")
+            return False
+        finally:
+            for path in (delta_path, patched_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def build_chunk_index(self, plan):
+        """Map every chunk of the files that are already up to date to its local copy."""
+        index = {}
+        # Solo file che non verranno toccati da questo aggiornamento
+        for entry in plan.up_to_date:
+            if "chunks" not in entry.file_info or entry.local_hash is None:
+                continue
+            for digest, offset, size in chunks.chunk_offsets(entry.file_info["chunks"]):
+                index.setdefault(digest, (entry.local_path, offset, size))
+        return index
+
+    def rebuild_from_chunks(self, path, local_path, file_info, file_name, target_path):
+        """Write target_path from chunks found locally, downloading only the missing ones."""
+        if not config.use_chunks or "chunks" not in file_info or not self.running:
+            return False
+        rebuild_path = target_path + ".rebuild"
+        try:
+            available = dict(self.chunk_index)
+            if os.path.exists(local_path):
+                old_chunks = self.file_state.lookup_chunks(local_path)
+                if old_chunks is None:
+                    if os.path.getsize(local_path) > config.chunk_local_max_size:
+                        # Il chunking in Python puro e piu lento del download
+                        return False
+                    old_chunks = chunks.file_chunks(local_path)
+                for digest, offset, size in chunks.chunk_offsets(old_chunks):
+                    available.setdefault(digest, (local_path, offset, size))
+            if not any(digest in available for digest, _ in file_info["chunks"]):
+                return False
+
+            self.current_file = file_name
+            self.emit("file_downloading", file_name)
+            self.note_metrics(file_name, method="chunks")
+            completed = self.fetch_from_mirrors(
+                path,
+                file_info["size"],
+                file_name,
+                lambda url, stats: chunks.rebuild_file(
+                    url,
+                    rebuild_path,
+                    file_info["chunks"],
+                    available,
+                    file_info["hash"],
+                    on_progress=self.progress_reporter(file_name, file_info["size"]),
+                    should_continue=lambda: self.running,
+                    stats=stats,
+                ),
+            )
+            if not completed:
+                return False
+            os.replace(rebuild_path, target_path)
+            return True
+        except Exception as e:
+            print(f"Chunk rebuild failed for {file_name}, downloading full file: {e}")
+            self.note_metrics(file_name, error=f"chunks: {e}")
+            return False
+        finally:
+            if os.path.exists(rebuild_path):
+                os.remove(rebuild_path)
+
+    def note_metrics(self, file_name, **values):
+        if self.metrics is not None:
+            self.metrics.note(file_name, **values)
+
+    def add_metrics(self, file_name, stats):
+        """Add the stats filled by download_to_file to the file metrics."""
+        if self.metrics is not None and stats:
+            self.metrics.add(file_name, **stats)
+
+    def fetch_from_mirrors(self, path, size, file_name, fetch):
+        """Call fetch(url, stats) on the best mirror for path, failing over to the others.
+
+        Returns fetch's result (False: stopped). When every mirror failed the
+        last error is raised.
+        """
+        tried = []
+        last_error = download.DownloadError(f"no mirror left for {path}")
+        while True:
+            mirror = self.mirrors.acquire(size, tried)
+            if mirror is None:
+                raise last_error
+            tried.append(mirror)
+            stats = {}
+            started = time.perf_counter()
+            ok = None
+            try:
+                ok = fetch(mirror.url(path), stats)
+                if ok:
+                    self.note_metrics(file_name, mirror=mirror.base_url)
+                return ok
+            except Exception as e:
+                ok = False
+                last_error = e
+                if not self.running:
+                    raise
+                if len(tried) < len(self.mirrors):
+                    print(f"{mirror.url(path)} failed, trying another mirror: {e}")
+            finally:
+                self.add_metrics(file_name, stats)
+                self.mirrors.release(
+                    mirror,
+                    ok if self.running else None,
+                    stats.get("bytes_received", 0),
+                    time.perf_counter() - started,
+                )
+
+    def progress_reporter(self, file_name, weight):
+        """Callback that feeds downloaded bytes to the overall progress aggregator."""
+        return self.progress.tracker(file_name, weight)
+
+    def download_file(
+        self,
+        path,
+        local_path,
+        file_size,
+        total_size,
+        file_name,
+        expected_hash=None,
+        compressed=None,
+    ):
+        """Download a single file, resuming a previous partial transfer if any.
+
+        path is relative to the pack folder of the mirrors, local_path is
+        where the file is written. Returns True once it is complete and verified.
+        """
+        try:
+            if not self.running:
+                return False
+            self.current_file = file_name
+            self.emit("file_downloading", file_name)
+
+            compression_format = transfer_size = None
+            if (
+                config.use_compression
+                and compressed
+                and compressed["format"] in compression.supported_formats()
+            ):
+                path = compressed["file"]
+                compression_format = compressed["format"]
+                transfer_size = compressed["size"]
+            self.note_metrics(file_name, method=compression_format or "full")
+
+            completed = self.fetch_from_mirrors(
+                path,
+                transfer_size or file_size,
+                file_name,
+                lambda url, stats: download.download_to_file(
+                    url,
+                    local_path,
+                    expected_hash=expected_hash,
+                    expected_size=file_size,
+                    on_progress=self.progress_reporter(file_name, file_size),
+                    should_continue=lambda: self.running,
+                    compression_format=compression_format,
+                    transfer_size=transfer_size,
+                    stats=stats,
+                ),
+            )
+            return completed
+        except Exception as e:
+            print(f"Error downloading {path}: {e}")
+            self.note_metrics(file_name, error=str(e))
+            return False
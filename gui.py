@@ -1,5 +1,5 @@
 from PyQt5.QtCore import pyqtSignal, Qt, QTimer, QPoint, QEvent, QSize
-from PyQt5.QtGui import QPalette, QBrush, QPixmap, QIcon, QMovie, QPainter
+from PyQt5.QtGui import QPalette, QBrush, QPixmap, QIcon, QMovie, QPainter, QImageReader
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -11,6 +11,7 @@ from PyQt5.QtWidgets import (
     QStackedWidget,
     QMessageBox,
     QDesktopWidget,
+    QMenu,
 )
 from PyQt5 import QtCore
 
@@ -20,29 +21,26 @@ import webbrowser
 import subprocess
 import config
 import ctypes
-import hashlib
-import requests
+import hashing
+import patchlist_cache
+from progress import format_eta, format_speed
 
 
-def hash_file(filename):
-    """Calculate the sha256 hash of a file incrementally."""
-    h = hashlib.sha256()
-    with open(filename, "rb") as file:
-        while chunk := file.read(4096):
-            h.update(chunk)
-    return h.hexdigest().upper()
+def hash_file(filename, file_state=None):
+    """Calculate the sha256 hash of a file, skipping the read if file_state knows it unchanged."""
+    known_hash = file_state.lookup(filename) if file_state is not None else None
+    if known_hash is None:
+        known_hash = hashing.hash_file(filename)
+        if file_state is not None:
+            # Salvato dall'engine insieme al resto dell'indice
+            file_state.record(filename, known_hash)
+    return known_hash.upper()
 
 
 def get_patchlist_json():
-    """Download the patchlist.json file from the remote server."""
-    url = config.patchlist_url
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Error downloading patchlist.json: {e}")
-        return None
+    """Download the patchlist.json file from the remote server (once per session)."""
+    patchlist, _, _ = patchlist_cache.fetch_patchlist(config.patchlist_url)
+    return patchlist
 
 
 def get_stored_patcher_hash(patchlist_json):
@@ -52,6 +50,7 @@ def get_stored_patcher_hash(patchlist_json):
 
 class UpdateWindow(QWidget):
     start_update_signal = pyqtSignal()
+    repair_signal = pyqtSignal()
     file_downloading = pyqtSignal(str)
 
     def __init__(self):
@@ -88,7 +87,9 @@ class UpdateWindow(QWidget):
         self.setAttribute(Qt.WA_TranslucentBackground, True)  # <-- Aggiunto
         self.movie = QMovie(self.resource_path(str(config.background_image_path)))
         self.movie.setScaledSize(self.size())
+        self.movie.frameChanged.connect(self.update)
         self.movie.start()
+        self.animations_paused = False
 
         # Imposta l'icona della finestra
         self.setWindowIcon(QIcon(self.resource_path(str(config.icon_path))))
@@ -97,9 +98,7 @@ class UpdateWindow(QWidget):
 
         main_layout = QVBoxLayout(self)
         main_layout.setContentsMargins(20, 20, 20, 20)
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update)
-        self.timer.start(50)
+        self.pixmap_cache = {}
         self.close_button = QPushButton("X", self)
         self.close_button.setFixedSize(30, 30)
         self.close_button.move(self.width() - 40, 10)
@@ -131,10 +130,12 @@ class UpdateWindow(QWidget):
 
         self.image_slide = QStackedWidget(self)
 
+        self.slides = []
         self.slide1_button = self.create_image_button(config.slide1, config.slide1url)
         self.slide2_button = self.create_image_button(config.slide2, config.slide2url)
         self.slide3_button = self.create_image_button(config.slide3, config.slide3url)
         self.slide4_button = self.create_image_button(config.slide4, config.slide4url)
+        self.load_slide(0)
 
         banner_layout.addWidget(self.image_slide)
         main_layout.addLayout(banner_layout)
@@ -228,7 +229,10 @@ class UpdateWindow(QWidget):
         self.set_image(self.update_button, config.start_button_image, (100, 100))
         self.update_button.setIconSize(QtCore.QSize(100, 100))
         self.update_button.setStyleSheet("background: transparent; border: none;")
-        self.update_button.clicked.connect(self.emit_update_signal)
+        self.launch_enabled = False  # False: il pulsante avvia/riprende l'aggiornamento
+        self.update_button.clicked.connect(self.on_update_button)
+        self.update_button.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.update_button.customContextMenuRequested.connect(self.show_repair_menu)
         self.update_button.installEventFilter(self)
         progress_layout.addWidget(self.update_button)
 
@@ -254,6 +258,7 @@ class UpdateWindow(QWidget):
 
         main_layout.addLayout(button_layout)
         self.current_index = 0
+        self.file_state = None  # indice dell'engine, per non rileggere il patcher
         self.image_paths = []
         self.file_downloading.connect(self.on_file_downloading)
 
@@ -268,6 +273,7 @@ class UpdateWindow(QWidget):
             self.slide4_button: config.slide4,
         }
         self.text_block.hide()
+        QTimer.singleShot(0, self.preload_button_images)
 
     def set_file_checking_text(self, file_name):
         # Aggiorna il testo della label per indicare quale file sta venendo verificato
@@ -283,9 +289,39 @@ class UpdateWindow(QWidget):
     def paintEvent(self, event):
         painter = QPainter(self)
         current_frame = self.movie.currentPixmap()
-        if not current_frame.isNull():
+        if current_frame.isNull():
+            return
+        if current_frame.size() == self.size():
+            painter.drawPixmap(0, 0, current_frame)
+        else:
             painter.drawPixmap(0, 0, self.width(), self.height(), current_frame)
 
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            self.set_animations_paused(self.isMinimized())
+        super().changeEvent(event)
+
+    def showEvent(self, event):
+        self.set_animations_paused(self.isMinimized())
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.set_animations_paused(True)
+        super().hideEvent(event)
+
+    def set_animations_paused(self, paused):
+        """Stop background, banner and slide timer while nobody can see the window"""
+        if paused == self.animations_paused:
+            return
+        self.animations_paused = paused
+        self.movie.setPaused(paused)
+        if paused:
+            self.timer.stop()
+            self.release_slide(self.current_index)
+        else:
+            self.timer.start(5000)
+            self.load_slide(self.current_index)
+
 
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
@@ -307,12 +343,10 @@ class UpdateWindow(QWidget):
 
             if event.type() == QEvent.Enter:
                 hover_image_path = image_path.replace(".png", "_down.png")
-                hover_image_path = self.resource_path(hover_image_path)
                 self.set_image(source, hover_image_path, (1300, 300))
 
             elif event.type() == QEvent.Leave:
-                regular_image_path = self.resource_path(image_path)
-                self.set_image(source, regular_image_path, (1300, 300))
+                self.set_image(source, image_path, (1300, 300))
 
         return super().eventFilter(source, event)
 
@@ -330,7 +364,7 @@ class UpdateWindow(QWidget):
     def run_self_updater(self):
         filename = config.patcher_name
         """Run the self-update executable in a completely separate process."""
-        current_hash = hash_file(filename).lower()
+        current_hash = hash_file(filename, self.file_state).lower()
         patchlist_json = get_patchlist_json()
         remote_hash = get_stored_patcher_hash(patchlist_json)
         if current_hash == remote_hash:
@@ -360,17 +394,13 @@ class UpdateWindow(QWidget):
         #    }
         # """)
 
+        # Solo la slide visibile viene caricata, le altre quando tocca a loro
         image_label = QLabel(self)
-
-        if image_path.lower().endswith(".gif"):
-            movie = QMovie(self.resource_path(image_path))
-            image_label.setMovie(movie)
-            movie.start()
-        else:
-            pixmap = QPixmap(image_path)
-            image_label.setPixmap(pixmap)
-
+        image_size = QImageReader(self.resource_path(image_path)).size()
+        if image_size.isValid():
+            image_label.setFixedSize(image_size)
         image_label.setAlignment(Qt.AlignCenter)
+        self.slides.append((image_label, image_path))
 
         image_button_layout = QVBoxLayout(image_button)
         image_button_layout.setContentsMargins(0, 0, 0, 0)
@@ -398,10 +428,33 @@ class UpdateWindow(QWidget):
         if self.image_slide.count() == 0:
             return
 
+        self.release_slide(self.current_index)
         self.current_index = (self.current_index + 1) % self.image_slide.count()
+        self.load_slide(self.current_index)
 
         self.image_slide.setCurrentIndex(self.current_index)
 
+    def load_slide(self, index):
+        """Decode a slide when it is shown; GIFs get a fresh QMovie each time"""
+        image_label, image_path = self.slides[index]
+        if image_label.movie() is not None:
+            return
+        if image_path.lower().endswith(".gif"):
+            movie = QMovie(self.resource_path(image_path), parent=image_label)
+            image_label.setMovie(movie)
+            movie.start()
+        elif image_label.pixmap() is None or image_label.pixmap().isNull():
+            image_label.setPixmap(QPixmap(image_path))
+
+    def release_slide(self, index):
+        """Hidden slides give back their QMovie and its frames, only the static ones stay"""
+        image_label = self.slides[index][0]
+        movie = image_label.movie()
+        if movie is not None:
+            movie.stop()
+            image_label.clear()
+            movie.deleteLater()
+
     def run_the_seed(self):
         """Run the .exe program and close the app"""
         try:
@@ -432,15 +485,39 @@ class UpdateWindow(QWidget):
     def set_label_text(self, text):
         """Set the text for the progress bar or status message"""
         self.progress_bar.setFormat(text)
-        if config.update_complete in text:
-            self.update_button.clicked.disconnect()
-            self.update_button.clicked.connect(self.run_the_seed)
 
-    def set_progress(self, value, file_name):
-        """Update the progress bar value and set the text."""
+    def on_update_button(self):
+        """Start button: run the game once it can start, otherwise (re)start the update"""
+        if self.launch_enabled:
+            self.run_the_seed()
+        else:
+            self.emit_update_signal()
+
+    def enable_launch(self):
+        """Required files are ready: the start button runs the game while the rest downloads"""
+        self.launch_enabled = True
+        self.progress_bar.setFormat(config.launch_ready_text)
+
+    def update_finished(self):
+        """The client is up to date: the start button runs the game"""
+        self.launch_enabled = True
+        self.progress_bar.setFormat(config.update_complete)
+
+    def update_failed(self, text):
+        """The update stopped short: the start button resumes it instead of launching"""
+        self.launch_enabled = False
+        self.progress_bar.setFormat(text)
+
+    def set_progress(self, value, file_name="", speed=None, eta=None):
+        """Update the progress bar value and set the text (with speed and ETA if known)."""
         self.progress_bar.setValue(value)
 
-        self.progress_bar.setFormat(f"{file_name} - {value}%")
+        text = f"{file_name} - {value}%"
+        if speed:
+            text += f" - {format_speed(speed)}"
+        if eta is not None and eta >= 0:
+            text += f" - ETA {format_eta(eta)}"
+        self.progress_bar.setFormat(text)
 
     def resource_path(self, relative_path):
         """Manage resource path"""
@@ -465,22 +542,46 @@ class UpdateWindow(QWidget):
 
     def set_image(self, widget, image_path, size):
         """Set an image for the widget"""
-        full_path = self.resource_path(image_path)
-        pixmap = QPixmap(full_path)
-        if pixmap.isNull():
-            print(f"Errore: impossibile caricare l'immagine '{full_path}'")
-        else:
+        pixmap = self.scaled_pixmap(image_path, size)
+        if pixmap is not None:
             if isinstance(widget, QLabel):
-                widget.setPixmap(pixmap.scaled(size[0], size[1], Qt.KeepAspectRatio))
+                widget.setPixmap(pixmap)
             elif isinstance(widget, QPushButton):
-                widget.setIcon(
-                    QIcon(pixmap.scaled(size[0], size[1], Qt.KeepAspectRatio))
+                widget.setIcon(QIcon(pixmap))
+
+    def preload_button_images(self):
+        """Fill the cache with the hover images once the window is on screen"""
+        for image_path in self.button_images.values():
+            if image_path.lower().endswith(".png"):
+                self.scaled_pixmap(image_path, (1300, 300))
+                self.scaled_pixmap(image_path.replace(".png", "_down.png"), (1300, 300))
+
+    def scaled_pixmap(self, image_path, size):
+        """Load and scale an image once; hover on and off reuses the cached pixmap"""
+        full_path = self.resource_path(image_path)
+        key = (full_path, size)
+        if key not in self.pixmap_cache:
+            pixmap = QPixmap(full_path)
+            if pixmap.isNull():
+                print(f"Errore: impossibile caricare l'immagine '{full_path}'")
+                self.pixmap_cache[key] = None
+            else:
+                self.pixmap_cache[key] = pixmap.scaled(
+                    size[0], size[1], Qt.KeepAspectRatio, Qt.SmoothTransformation
                 )
+        return self.pixmap_cache[key]
 
     def emit_update_signal(self):
         """Emit the signal to start the update process"""
         self.start_update_signal.emit()
 
+    def show_repair_menu(self, position):
+        """Right click on the start button: offer a full check of every file"""
+        menu = QMenu(self)
+        repair_action = menu.addAction("Repair client (full check)")
+        if menu.exec_(self.update_button.mapToGlobal(position)) == repair_action:
+            self.repair_signal.emit()
+
     def on_file_downloading(self, file_name):
         """Listen to the downloading package name and update the progress bar"""
         self.current_file = file_name
@@ -0,0 +1,203 @@
+import ctypes
+import hashlib
+import mmap
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+
+
+def hash_file(file_path, algorithm="sha256"):
+    """Return the hex digest of a file, read in large blocks or through mmap."""
+    h = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size and size >= config.hash_mmap_threshold:
+            # hashlib releases the GIL while it works on big buffers,
+            # so several files can be hashed in parallel threads.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for start in range(0, size, config.hash_block_size):
+                        h.update(view[start : start + config.hash_block_size])
+                finally:
+                    view.release()
+        else:
+            buffer = bytearray(config.hash_block_size)
+            view = memoryview(buffer)
+            while read := f.readinto(buffer):
+                h.update(view[:read])
+    return h.hexdigest()
+
+
+def hash_prefix(file_path, length, algorithm="sha256"):
+    """Return a hasher already fed with the first length bytes of a file."""
+    h = hashlib.new(algorithm)
+    buffer = bytearray(config.hash_block_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb") as f:
+        while length > 0:
+            read = f.readinto(view[: min(length, len(buffer))])
+            if not read:
+                break
+            h.update(view[:read])
+            length -= read
+    return h
+
+
+def sample_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def make_samples(file_path, count=16, block=64 * 1024):
+    """Hashes of the head, the tail and count evenly spaced blocks of a file."""
+    size = os.path.getsize(file_path)
+    offsets = {0, max(0, size - block)}
+    if size > block:
+        step = max(1, (size - block) // (count + 1))
+        offsets.update(min(size - block, step * i) for i in range(1, count + 1))
+    hashes = []
+    with open(file_path, "rb") as f:
+        for offset in sorted(offsets):
+            f.seek(offset)
+            hashes.append([offset, sample_hash(f.read(block))])
+    return {"block": block, "hashes": hashes}
+
+
+def check_samples(file_path, samples, random_count):
+    """Compare head, tail and random_count random published blocks with the file."""
+    hashes = samples["hashes"]
+    if len(hashes) > 2:
+        chosen = [hashes[0], hashes[-1]] + random.sample(
+            hashes[1:-1], min(random_count, len(hashes) - 2)
+        )
+    else:
+        chosen = hashes
+    with open(file_path, "rb") as f:
+        for offset, expected in chosen:
+            f.seek(offset)
+            if sample_hash(f.read(samples["block"])) != expected:
+                return False
+    return True
+
+
+def _linux_is_rotational(path):
+    dev = os.stat(path).st_dev
+    block = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    # Partitions have no queue folder, their parent disk does.
+    for queue in (os.path.join(block, "queue"), os.path.join(block, "..", "queue")):
+        try:
+            with open(os.path.join(queue, "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def _windows_is_rotational(path):
+    from ctypes import wintypes
+
+    class STORAGE_PROPERTY_QUERY(ctypes.Structure):
+        _fields_ = [
+            ("PropertyId", wintypes.DWORD),
+            ("QueryType", wintypes.DWORD),
+            ("AdditionalParameters", wintypes.BYTE * 1),
+        ]
+
+    class DEVICE_SEEK_PENALTY_DESCRIPTOR(ctypes.Structure):
+        _fields_ = [
+            ("Version", wintypes.DWORD),
+            ("Size", wintypes.DWORD),
+            ("IncursSeekPenalty", wintypes.BOOLEAN),
+        ]
+
+    IOCTL_STORAGE_QUERY_PROPERTY = 0x2D1400
+    StorageDeviceSeekPenaltyProperty = 7
+    FILE_SHARE_READ_WRITE = 0x1 | 0x2
+    OPEN_EXISTING = 3
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    drive = os.path.splitdrive(os.path.abspath(path))[0]
+    handle = kernel32.CreateFileW(
+        f"\\\\.\\{drive}", 0, FILE_SHARE_READ_WRITE, None, OPEN_EXISTING, 0, None
+    )
+    if handle == INVALID_HANDLE_VALUE:
+        return None
+    try:
+        query = STORAGE_PROPERTY_QUERY(StorageDeviceSeekPenaltyProperty, 0)
+        result = DEVICE_SEEK_PENALTY_DESCRIPTOR()
+        returned = wintypes.DWORD()
+        ok = kernel32.DeviceIoControl(
+            wintypes.HANDLE(handle),
+            IOCTL_STORAGE_QUERY_PROPERTY,
+            ctypes.byref(query),
+            ctypes.sizeof(query),
+            ctypes.byref(result),
+            ctypes.sizeof(result),
+            ctypes.byref(returned),
+            None,
+        )
+        return bool(result.IncursSeekPenalty) if ok else None
+    finally:
+        kernel32.CloseHandle(wintypes.HANDLE(handle))
+
+
+def is_rotational(path):
+    """Guess whether path lives on a spinning disk (None if it cannot be told)."""
+    if config.storage_type in ("ssd", "hdd"):
+        return config.storage_type == "hdd"
+    try:
+        if sys.platform.startswith("linux"):
+            return _linux_is_rotational(path)
+        if sys.platform == "win32":
+            return _windows_is_rotational(path)
+    except Exception as e:
+        print(f"Unable to detect storage type for {path}: {e}")
+    return None
+
+
+def pick_workers(path):
+    """How many files to hash at once on the disk holding path."""
+    if is_rotational(path):
+        # Parallel reads make a spinning disk seek back and forth.
+        return max(1, config.hash_workers_hdd)
+    if config.hash_workers_ssd > 0:
+        return config.hash_workers_ssd
+    return min(8, os.cpu_count() or 1)
+
+
+def run_parallel(func, items, workers):
+    """Call func on every item in a thread pool and yield (item, result) as they finish.
+
+    Closing the generator early cancels every call that has not started yet.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(func, item): item for item in items}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def hash_files(paths, workers=None, algorithm="sha256"):
+    """Hash many files in parallel, yielding (path, digest) as each one finishes."""
+    paths = list(paths)
+    if not paths:
+        return
+    if workers is None:
+        workers = pick_workers(os.path.dirname(os.path.abspath(paths[0])))
+
+    def safe_hash(path):
+        try:
+            return hash_file(path, algorithm)
+        except Exception as e:
+            print(f"Error calculating hash for {path}: {e}")
+            return None
+
+    yield from run_parallel(safe_hash, paths, workers)
@@ -0,0 +1,215 @@
+"""Transfer and verification metrics, written as JSON lines.
+
+Every update run writes one record per fetched or re-hashed file and one for
+the run itself to config.metrics_log_file (rotated by size), for example:
+
+    {"type": "file", "run": "3f2a9c01b7de", "file": "item.epk", "method": "full",
+     "ok": true, "duration": 2.31, "connect_time": 0.041, "ttfb": 0.12,
+     "bytes_received": 8388608, "throughput": 3631432, "retries": 0,
+     "bytes_hashed": 8388608, "hash_time": 0.019}
+    {"type": "hash", "run": "3f2a9c01b7de", "file": "pack/root.epk", ...}
+    {"type": "run", "run": "3f2a9c01b7de", "kind": "update", "status": "complete",
+     "phases": {"fetch_manifest": 0.18, "reconcile": 0.9, "download": 12.4, "finalize": 0.01}, ...}
+
+With config.metrics_port the latest records are also served as JSON on
+http://127.0.0.1:<port>/metrics.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+import config
+
+
+recent = deque(maxlen=500)  # ultimi record, per l'endpoint locale
+active_runs = []
+_lock = threading.Lock()
+_logger = None
+_server = None
+
+
+def get_logger():
+    """Logger writing one JSON object per line to the rotating metrics log."""
+    global _logger
+    with _lock:
+        if _logger is None:
+            _logger = logging.getLogger("autopatcher.metrics")
+            _logger.setLevel(logging.INFO)
+            _logger.propagate = False
+            if config.metrics_log_file:
+                try:
+                    handler = RotatingFileHandler(
+                        config.metrics_log_file,
+                        maxBytes=config.metrics_log_max_bytes,
+                        backupCount=config.metrics_log_backups,
+                        encoding="utf-8",
+                    )
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    _logger.addHandler(handler)
+                except Exception as e:
+                    print(f"Error opening metrics log: {e}")
+        return _logger
+
+
+def write(record):
+    record = {
+        key: round(value, 4) if isinstance(value, float) else value
+        for key, value in record.items()
+    }
+    with _lock:
+        recent.append(record)
+    get_logger().info(json.dumps(record))
+
+
+class RunMetrics:
+    """Phase durations of one run and the per-file records written during it."""
+
+    def __init__(self, kind):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.files = {}
+        self.fields = {}  # altri dati del run (tempi di avvio)
+        self.totals = {
+            "files": 0,
+            "failed": 0,
+            "bytes_received": 0,
+            "bytes_hashed": 0,
+            "hash_time": 0.0,
+        }
+        with _lock:
+            active_runs.append(self)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def add(self, file_name, **values):
+        """Add numeric values (bytes, seconds, retries) to a file still in progress."""
+        with self.lock:
+            record = self.files.setdefault(file_name, {})
+            for key, value in values.items():
+                record[key] = record.get(key, 0) + value
+
+    def note(self, file_name, **values):
+        """Set fields (method, error) of a file still in progress."""
+        with self.lock:
+            self.files.setdefault(file_name, {}).update(values)
+
+    def finish_file(self, file_name, ok, duration):
+        """Write the record of a fetched file."""
+        with self.lock:
+            record = self.files.pop(file_name, {})
+            self.totals["files"] += 1
+            self.totals["failed"] += 0 if ok else 1
+            self.totals["bytes_received"] += record.get("bytes_received", 0)
+            self.totals["bytes_hashed"] += record.get("bytes_hashed", 0)
+            self.totals["hash_time"] += record.get("hash_time", 0.0)
+        received = record.get("bytes_received", 0)
+        write(
+            {
+                "type": "file",
+                "run": self.run_id,
+                "file": file_name,
+                "ok": ok,
+                "duration": duration,
+                "throughput": round(received / duration) if duration > 0 else None,
+                **record,
+            }
+        )
+
+    def hashed(self, file_path, size, seconds):
+        """Write the record of a local file read back to check its hash."""
+        with self.lock:
+            self.totals["bytes_hashed"] += size
+            self.totals["hash_time"] += seconds
+        write(
+            {
+                "type": "hash",
+                "run": self.run_id,
+                "file": file_path,
+                "bytes_hashed": size,
+                "hash_time": seconds,
+                "throughput": round(size / seconds) if seconds > 0 else None,
+            }
+        )
+
+    def snapshot(self, status="running"):
+        with self.lock:
+            return {
+                "type": "run",
+                "run": self.run_id,
+                "kind": self.kind,
+                "status": status,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "duration": time.time() - self.started,
+                "phases": {name: round(value, 4) for name, value in self.phases.items()},
+                **self.totals,
+                **self.fields,
+            }
+
+    def finish(self, status):
+        """Write the run record: phases, totals and how the run ended."""
+        with _lock:
+            if self in active_runs:
+                active_runs.remove(self)
+        write(self.snapshot(status))
+
+
+def metrics_body():
+    """JSON served on /metrics: the runs in progress and the latest records."""
+    with _lock:
+        runs = list(active_runs)
+        records = list(recent)
+    return json.dumps({"active": [run.snapshot() for run in runs], "recent": records}).encode()
+
+
+def serve(port=None):
+    """Start the local metrics endpoint once per process (port 0 = disabled)."""
+    global _server
+    port = config.metrics_port if port is None else port
+    if not port:
+        return None
+    # Importato solo se l'endpoint e attivo: non pesa sull'avvio
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics_body()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _lock:
+        if _server is not None:
+            return _server
+        try:
+            # Solo localhost: i dati restano sul PC del giocatore
+            _server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+            _server.daemon_threads = True
+        except OSError as e:
+            print(f"Error starting metrics endpoint on port {port}: {e}")
+            return None
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
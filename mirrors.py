@@ -0,0 +1,135 @@
+"""Pack mirrors: latency/throughput probing, load spreading and failover.
+
+Every mirror serves the same tree as config.pack_url. Mirrors come from
+config.pack_mirrors and from the "mirrors" list of the patchlist. Files are
+checked against the patchlist hash whatever mirror they come from, so a bad
+mirror can cost time but never corrupt the client.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import transport
+
+
+PROBE_BYTES = 64 * 1024
+
+
+class Mirror:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.latency = None  # secondi fino agli header
+        self.throughput = None  # byte al secondo, media mobile
+        self.active = 0
+        self.failures = 0
+
+    @property
+    def healthy(self):
+        return self.failures < config.mirror_max_failures
+
+    def url(self, path):
+        return f"{self.base_url}/{path}"
+
+    def expected_time(self, size):
+        """Estimated seconds to fetch size bytes, used to rank the mirrors."""
+        latency = self.latency if self.latency is not None else 1.0
+        if not self.throughput:
+            return latency
+        return latency + size / self.throughput
+
+    def __repr__(self):
+        return f"Mirror({self.base_url})"
+
+
+class MirrorPool:
+    """The mirrors of one update, ranked by measured speed."""
+
+    def __init__(self, base_urls):
+        self.lock = threading.Lock()
+        self.mirrors = []
+        for base_url in base_urls:
+            if base_url and base_url.rstrip("/") not in [m.base_url for m in self.mirrors]:
+                self.mirrors.append(Mirror(base_url))
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def probe(self, path):
+        """Time a small Range request for path on every mirror, all at once."""
+        if len(self.mirrors) < 2:
+            return
+        with ThreadPoolExecutor(max_workers=len(self.mirrors)) as executor:
+            list(executor.map(lambda mirror: self.probe_mirror(mirror, path), self.mirrors))
+        ranking = ", ".join(
+            f"{m.base_url} ({m.latency * 1000:.0f} ms)" if m.healthy else f"{m.base_url} (down)"
+            for m in self.ranked()
+        )
+        print(f"Mirrors: {ranking}")
+
+    def probe_mirror(self, mirror, path):
+        started = time.perf_counter()
+        try:
+            with transport.get(
+                mirror.url(path),
+                stream=True,
+                headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"},
+                timeout=(config.mirror_probe_timeout, config.mirror_probe_timeout),
+            ) as response:
+                response.raise_for_status()
+                latency = time.perf_counter() - started
+                received = 0
+                for block in response.iter_content(chunk_size=config.download_chunk_size):
+                    received += len(block)
+                    if received >= PROBE_BYTES:
+                        break
+            elapsed = time.perf_counter() - started - latency
+            with self.lock:
+                mirror.latency = latency
+                if received and elapsed > 0:
+                    mirror.throughput = received / elapsed
+        except Exception as e:
+            print(f"Mirror {mirror.base_url} did not answer: {e}")
+            with self.lock:
+                mirror.failures = config.mirror_max_failures
+
+    def ranked(self, size=0):
+        """Healthy mirrors first, fastest first."""
+        with self.lock:
+            return sorted(
+                self.mirrors,
+                key=lambda m: (not m.healthy, m.expected_time(size)),
+            )
+
+    def acquire(self, size, exclude=()):
+        """Pick the mirror that should finish size bytes first, given its current load.
+
+        Mirrors in exclude (already tried for this file) are skipped; returns
+        None when every mirror has been tried.
+        """
+        with self.lock:
+            candidates = [m for m in self.mirrors if m not in exclude]
+            if not candidates:
+                return None
+            healthy = [m for m in candidates if m.healthy] or candidates
+            # Ogni trasferimento in corso divide la banda del mirror
+            mirror = min(healthy, key=lambda m: (m.active + 1) * m.expected_time(size))
+            mirror.active += 1
+            return mirror
+
+    def release(self, mirror, ok, received=0, seconds=0.0):
+        """Record how a transfer from mirror went (ok None: stopped, not judged)."""
+        with self.lock:
+            mirror.active -= 1
+            if ok is None:
+                return
+            if ok:
+                mirror.failures = 0
+                if received and seconds > 0:
+                    speed = received / seconds
+                    if mirror.throughput is None:
+                        mirror.throughput = speed
+                    else:
+                        mirror.throughput = 0.7 * mirror.throughput + 0.3 * speed
+            else:
+                mirror.failures += 1
@@ -0,0 +1,124 @@
+import os
+import pickle
+import threading
+from concurrent.futures import Future
+
+import config
+import transport
+
+
+_session_results = {}
+_in_flight = {}  # url -> Future della richiesta in corso
+_fetch_lock = threading.Lock()  # solo per i dizionari, mai durante la rete
+_cache_lock = threading.Lock()
+
+
+def load_cache(cache_file=config.patchlist_cache_file):
+    try:
+        with open(cache_file, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable patchlist cache: {e}")
+        return None
+
+
+def save_cache(cache, cache_file=config.patchlist_cache_file):
+    """Write the cached patchlist atomically."""
+    temp_file = cache_file + ".tmp"
+    try:
+        with open(temp_file, "wb") as f:
+            pickle.dump(cache, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, cache_file)
+    except Exception as e:
+        print(f"Error saving patchlist cache: {e}")
+
+
+def fetch_patchlist(url=config.patchlist_url, refresh=False):
+    """Return (patchlist, validator, unchanged) for url.
+
+    The patchlist is fetched at most once per process; later calls get the
+    same result unless refresh is True. The request carries the ETag and
+    Last-Modified of the cached copy, so an unchanged patchlist costs a 304
+    and unchanged is True. validator identifies the patchlist version
+    (ETag, Last-Modified or None). patchlist is None if it could not be fetched.
+    """
+    with _fetch_lock:
+        if not refresh and url in _session_results:
+            return _session_results[url]
+        # Una sola richiesta per url: chi arriva dopo aspetta quella in corso
+        in_flight = _in_flight.get(url)
+        if in_flight is None:
+            in_flight = _in_flight[url] = Future()
+            owner = True
+        else:
+            owner = False
+    if not owner:
+        return in_flight.result()
+
+    result = (None, None, False)
+    try:
+        result = request_patchlist(url)
+    finally:
+        with _fetch_lock:
+            if result[0] is not None:
+                _session_results[url] = result
+            del _in_flight[url]
+        in_flight.set_result(result)
+    return result
+
+
+def request_patchlist(url):
+    """Conditional GET of url against the cached copy, outside of any lock."""
+    with _cache_lock:
+        cache = load_cache()
+    if cache is not None and cache.get("url") != url:
+        cache = None
+    headers = {}
+    if cache is not None:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+
+    try:
+        response = transport.get(url, headers=headers)
+        if response.status_code == 304 and cache is not None:
+            return cache["patchlist"], cache_validator(cache), True
+        response.raise_for_status()
+        cache = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "patchlist": response.json(),
+        }
+        with _cache_lock:
+            save_cache(cache)
+        return cache["patchlist"], cache_validator(cache), False
+    except Exception as e:
+        print(f"Failed to download patchlist: {e}")
+        return None, None, False
+
+
+def prefetch(url=config.patchlist_url, on_ready=None):
+    """Start fetching the patchlist in the background, while the GUI is built.
+
+    The result lands in the per-process memo, so the fetch_patchlist call of
+    the update finds it there (or waits for the request already in flight).
+    """
+
+    def run():
+        result = fetch_patchlist(url)
+        if on_ready is not None:
+            on_ready(result)
+
+    thread = threading.Thread(target=run, name="patchlist-prefetch", daemon=True)
+    thread.start()
+    return thread
+
+
+def cache_validator(cache):
+    return cache.get("etag") or cache.get("last_modified")
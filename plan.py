@@ -0,0 +1,57 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+
+def format_size(size):
+    """Human readable byte count."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+@dataclass
+class PlannedFile:
+    """A file of the patchlist and what is known about its local copy."""
+
+    name: str
+    local_path: str
+    file_info: dict
+    local_hash: Optional[str] = None
+    is_exe: bool = False
+
+    @property
+    def size(self):
+        return self.file_info["size"]
+
+
+@dataclass
+class UpdatePlan:
+    """Result of the reconcile stage: what the download stage has to do."""
+
+    version: str
+    to_fetch: List[PlannedFile] = field(default_factory=list)
+    up_to_date: List[PlannedFile] = field(default_factory=list)
+    to_delete: List[str] = field(default_factory=list)
+
+    @property
+    def total_bytes(self):
+        return sum(entry.size for entry in self.to_fetch)
+
+    def is_empty(self):
+        return not self.to_fetch and not self.to_delete
+
+    def describe(self):
+        """Text report of the plan, used by the dry run."""
+        lines = [
+            f"Update plan for {self.version}:",
+            f"  {len(self.up_to_date)} files up to date",
+            f"  {len(self.to_fetch)} files to fetch ({format_size(self.total_bytes)})",
+        ]
+        for entry in self.to_fetch:
+            how = "missing" if entry.local_hash is None else "changed"
+            lines.append(f"    {entry.name} [{how}, {format_size(entry.size)}]")
+        lines.append(f"  {len(self.to_delete)} files to delete")
+        for local_path in self.to_delete:
+            lines.append(f"    {local_path}")
+        return "\n".join(lines)
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import deque
+
+import config
+
+
+def format_speed(bytes_per_second):
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if bytes_per_second < 1024 or unit == "MB/s":
+            return f"{bytes_per_second:.1f} {unit}"
+        bytes_per_second /= 1024
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class ProgressAggregator:
+    """Combine the progress of every transfer into one rate-limited report.
+
+    Each file weighs its size in the plan, whatever is actually transferred
+    for it (full file, compressed copy, delta or missing chunks), so the
+    overall percentage stays right. Throughput counts the bytes received.
+    callback(percent, file_name, bytes_per_second, eta_seconds) is called at
+    most once every config.progress_interval seconds; eta is -1 when unknown.
+    """
+
+    WINDOW = 5.0
+
+    def __init__(self, total_bytes, callback, interval=None):
+        self.total_bytes = total_bytes
+        self.callback = callback
+        self.interval = config.progress_interval if interval is None else interval
+        self.lock = threading.Lock()
+        self.files = {}
+        self.done = 0.0
+        self.received = 0
+        self.last_emit = 0.0
+        self.samples = deque([(time.monotonic(), 0, 0.0)])
+
+    def tracker(self, file_name, weight):
+        """on_progress(downloaded, size) callback for one transfer."""
+
+        def on_progress(downloaded, size):
+            self.update(file_name, weight, downloaded, size)
+
+        return on_progress
+
+    def update(self, file_name, weight, downloaded, size, force=False):
+        fraction = min(1.0, downloaded / size) if size else 1.0
+        with self.lock:
+            old_fraction, old_downloaded = self.files.get(file_name, (0.0, 0))
+            self.done += (fraction - old_fraction) * weight
+            # Un nuovo tentativo riparte da zero
+            self.received += downloaded - old_downloaded if downloaded >= old_downloaded else downloaded
+            self.files[file_name] = (fraction, downloaded)
+            now = time.monotonic()
+            if not force and now - self.last_emit < self.interval:
+                return
+            self.last_emit = now
+            report = self.snapshot(now)
+        self.callback(report[0], file_name, report[1], report[2])
+
+    def complete(self, file_name, weight):
+        """Count a file as done, whatever happened to it, and report right away."""
+        with self.lock:
+            downloaded = self.files.get(file_name, (0.0, 0))[1]
+        self.update(file_name, weight, max(downloaded, 1), 1, force=True)
+
+    def snapshot(self, now):
+        self.samples.append((now, self.received, self.done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.WINDOW:
+            self.samples.popleft()
+        first_time, first_received, first_done = self.samples[0]
+        elapsed = now - first_time
+        speed = (self.received - first_received) / elapsed if elapsed > 0 else 0.0
+        done_rate = (self.done - first_done) / elapsed if elapsed > 0 else 0.0
+        remaining = max(0.0, self.total_bytes - self.done)
+        eta = remaining / done_rate if done_rate > 0 else -1.0
+        percent = int(self.done * 100 / self.total_bytes) if self.total_bytes else 100
+        return min(100, percent), speed, eta
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import config
+
+
+class TokenBucket:
+    """Global bandwidth limiter shared by every transfer; the rate can change at any time."""
+
+    def __init__(self, bytes_per_second=0, burst_seconds=0.5):
+        self.lock = threading.Lock()
+        self.burst_seconds = burst_seconds
+        self.set_rate(bytes_per_second)
+
+    def set_rate(self, bytes_per_second):
+        """Change the limit (0 = unlimited), effective for the next chunk."""
+        with self.lock:
+            self.rate = max(0, bytes_per_second)
+            self.capacity = max(64 * 1024, self.rate * self.burst_seconds)
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+
+    def consume(self, amount):
+        """Wait until amount bytes may be transferred."""
+        while True:
+            with self.lock:
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens > 0:
+                    # Si puo andare in debito: un chunk grande non blocca per sempre
+                    self.tokens -= amount
+                    return
+                wait = -self.tokens / self.rate
+            time.sleep(min(wait, 0.1))
+
+
+bandwidth = TokenBucket(config.bandwidth_limit * 1024)
+
+
+def set_bandwidth_limit(kilobytes_per_second):
+    """Limit the download speed of the whole patcher (0 = unlimited)."""
+    bandwidth.set_rate(kilobytes_per_second * 1024)
+
+
+def order_files(entries, policy=None):
+    """Sort planned files: "patchlist" keeps the order, "smallest" or "priority" reorder it."""
+    policy = policy or config.download_order
+    if policy == "smallest":
+        return sorted(entries, key=lambda entry: entry.size)
+    if policy == "priority":
+        # Stabile: a pari priorita resta l'ordine della patchlist
+        return sorted(entries, key=lambda entry: -entry.file_info.get("priority", 0))
+    return list(entries)
+
+
+def schedule(to_fetch, policy=None, exe_order=None):
+    """Split the files to fetch into groups that run one after the other.
+
+    Files marked "required" in the patchlist come first, so the game can be
+    started as soon as that group is done. exe files go before or after the
+    other pack files as set by config.exe_order.
+    """
+    exe_order = exe_order or config.exe_order
+    required = [entry for entry in to_fetch if entry.file_info.get("required")]
+    others = [entry for entry in to_fetch if not entry.file_info.get("required")]
+    pack_files = [entry for entry in others if not entry.is_exe]
+    exe_files = [entry for entry in others if entry.is_exe]
+    groups = [order_files(required, policy)]
+    if exe_order == "first":
+        groups += [exe_files, order_files(pack_files, policy)]
+    else:
+        groups += [order_files(pack_files, policy), exe_files]
+    return [group for group in groups if group]
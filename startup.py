@@ -0,0 +1,33 @@
+"""Startup timings of the launcher, to spot regressions on slow PCs.
+
+mark() records the time since this module was imported (main.py imports it
+first); when enabled, every mark is printed as it happens:
+
+    [startup] imports: 180 ms
+    [startup] window shown: 420 ms
+    [startup] patchlist ready: 610 ms
+
+The update run record in the metrics log carries report() as "startup".
+"""
+import threading
+import time
+
+start = time.perf_counter()
+enabled = False
+marks = []
+_lock = threading.Lock()
+
+
+def mark(name):
+    elapsed = time.perf_counter() - start
+    with _lock:
+        marks.append((name, elapsed))
+    if enabled:
+        print(f"[startup] {name}: {elapsed * 1000:.0f} ms")
+    return elapsed
+
+
+def report():
+    """All marks so far, in milliseconds."""
+    with _lock:
+        return {name: round(elapsed * 1000) for name, elapsed in marks}
@@ -0,0 +1,136 @@
+import os
+import pickle
+import threading
+
+import config
+
+
+STATE_FORMAT = 1
+
+
+class FileStateIndex:
+    """Remember size, mtime and inode of every file whose hash was verified."""
+
+    def __init__(self, state_file=config.state_file_name):
+        self.state_file = state_file
+        self.entries = {}
+        self.meta = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load the index from disk, starting empty if it is missing or broken."""
+        try:
+            with open(self.state_file, "rb") as f:
+                data = pickle.load(f)
+            if data.get("format") == STATE_FORMAT:
+                self.entries = data.get("files", {})
+                self.meta = data.get("meta", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable state file {self.state_file}: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Write the index atomically so a crash never leaves a half-written file."""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {
+                "format": STATE_FORMAT,
+                "files": dict(self.entries),
+                "meta": dict(self.meta),
+            }
+            self.dirty = False
+        temp_file = self.state_file + ".tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                pickle.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            print(f"Error saving state file: {e}")
+
+    @staticmethod
+    def key(file_path):
+        return os.path.normcase(os.path.normpath(file_path))
+
+    @staticmethod
+    def signature(st):
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def lookup(self, file_path):
+        """Hash recorded for the file, or None if it changed since it was hashed."""
+        entry = self._current_entry(file_path)
+        return entry["hash"] if entry is not None else None
+
+    def lookup_chunks(self, file_path):
+        """Chunk list recorded for the file, or None if unknown or stale."""
+        return self.lookup_field(file_path, "chunks")
+
+    def lookup_field(self, file_path, name):
+        """Extra data recorded for the file (chunks, samples...), None if stale."""
+        entry = self._current_entry(file_path)
+        return entry.get(name) if entry is not None else None
+
+    def _current_entry(self, file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(self.key(file_path))
+        if entry is None or entry["signature"] != self.signature(st):
+            return None
+        return entry
+
+    def is_verified(self, file_path, expected_hash):
+        """True if the file is unchanged since it was last verified with this hash."""
+        return self.lookup(file_path) == expected_hash.lower()
+
+    def record(self, file_path, file_hash, chunks=None):
+        """Store the current signature of a file together with its hash."""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return
+        entry = {"hash": file_hash.lower(), "signature": self.signature(st)}
+        if chunks is not None:
+            entry["chunks"] = chunks
+        with self.lock:
+            self.entries[self.key(file_path)] = entry
+            self.dirty = True
+
+    def remember_chunks(self, file_path, file_hash, chunks):
+        """Attach a chunk list to a file already recorded with file_hash."""
+        self.remember_field(file_path, file_hash, "chunks", chunks)
+
+    def remember_field(self, file_path, file_hash, name, value):
+        """Attach extra data to a file already recorded with file_hash."""
+        with self.lock:
+            entry = self.entries.get(self.key(file_path))
+            if (
+                entry is not None
+                and entry["hash"] == file_hash.lower()
+                and entry.get(name) != value
+            ):
+                entry[name] = value
+                self.dirty = True
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            return self.meta.get(key, default)
+
+    def set_meta(self, key, value):
+        with self.lock:
+            if self.meta.get(key) != value:
+                self.meta[key] = value
+                self.dirty = True
+
+    def forget(self, file_path):
+        with self.lock:
+            if self.entries.pop(self.key(file_path), None) is not None:
+                self.dirty = True
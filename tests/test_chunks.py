@@ -0,0 +1,73 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import chunks
+
+
+class FakeRangeResponse:
+    def __init__(self, body, range_header):
+        start, end = range_header.split("=")[1].split("-")
+        self.body = body[int(start) : int(end) + 1]
+        self.status_code = 206
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+
+class RebuildFileTest(unittest.TestCase):
+    def test_stats_of_range_requests(self):
+        with tempfile.TemporaryDirectory() as folder:
+            old_path = os.path.join(folder, "old.epk")
+            new_path = os.path.join(folder, "new.epk")
+            out_path = os.path.join(folder, "out.epk")
+            old = os.urandom(256 * 1024)
+            new = old[: 128 * 1024] + os.urandom(64 * 1024) + old[128 * 1024 :]
+            for path, data in ((old_path, old), (new_path, new)):
+                with open(path, "wb") as f:
+                    f.write(data)
+            new_chunks = chunks.file_chunks(new_path)
+            available = {
+                digest: (old_path, offset, size)
+                for digest, offset, size in chunks.chunk_offsets(chunks.file_chunks(old_path))
+            }
+            missing = sum(
+                end - start for start, end in chunks.missing_ranges(new_chunks, available)
+            )
+
+            stats = {}
+            with mock.patch.object(
+                chunks.transport,
+                "get",
+                side_effect=lambda url, stream, headers: FakeRangeResponse(new, headers["Range"]),
+            ), mock.patch.object(chunks.transport, "last_timing", return_value=(0.01, 0.02)):
+                completed = chunks.rebuild_file(
+                    "http://example.com/pack/new.epk",
+                    out_path,
+                    new_chunks,
+                    available,
+                    hashlib.sha256(new).hexdigest(),
+                    stats=stats,
+                )
+
+            self.assertTrue(completed)
+            self.assertGreater(missing, 0)
+            self.assertEqual(stats["bytes_received"], missing)
+            self.assertEqual(stats["ttfb"], 0.02)
+            self.assertGreater(stats["connect_time"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
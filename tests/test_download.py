@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import download
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+        self.status_code = 200
+        self.headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+
+class DownloadToFileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def download(self, body, expected_size):
+        local_path = os.path.join(self.folder.name, "item.epk")
+        with mock.patch.object(
+            download.transport, "get", return_value=FakeResponse(body)
+        ), mock.patch.object(download.transport, "last_timing", return_value=(0.0, 0.0)):
+            completed = download.download_to_file(
+                "http://example.com/pack/item.epk",
+                local_path,
+                expected_hash=hashlib.sha256(body).hexdigest(),
+                expected_size=expected_size,
+            )
+        return completed, local_path
+
+    def test_zero_byte_file(self):
+        completed, local_path = self.download(b"", 0)
+        self.assertTrue(completed)
+        self.assertEqual(os.path.getsize(local_path), 0)
+        self.assertFalse(os.path.exists(local_path + ".part"))
+
+    def test_small_file(self):
+        completed, local_path = self.download(b"pack data", 9)
+        self.assertTrue(completed)
+        with open(local_path, "rb") as f:
+            self.assertEqual(f.read(), b"pack data")
+
+
+if __name__ == "__main__":
+    unittest.main()
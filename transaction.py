@@ -0,0 +1,165 @@
+"""Staged update transaction with a crash-safe journal.
+
+New files are written under config.staging_folder, never over the client.
+journal.log there is append-only, one JSON object per line, fsynced:
+
+    {"version": "patch_1.3"}                                   opened for this version
+    {"done": "pack/item.epk", "target": "pack/item.epk", "hash": "...", "size": 123}
+    {"commit": ["pack/item.epk"], "delete": [], "final": false}  early swap (required files)
+    {"commit": [...], "delete": ["pack/old.epk"], "final": true}
+
+Nothing is written until the first file is staged, so a launch with the
+client already up to date does not touch the disk.
+
+A commit line is written before its files are moved, and moving is
+idempotent, so after a crash the next start replays every commit line
+(roll forward). A final commit means every file of the version arrived:
+only then is the version file written. Without it the update resumes: files
+already marked done are not downloaded or hashed again.
+"""
+import json
+import os
+import shutil
+import threading
+
+import config
+
+
+def staging_key(entry):
+    """Name of a planned file inside the staging folder."""
+    return ("exe/" if entry.is_exe else "pack/") + entry.name
+
+
+class UpdateTransaction:
+    def __init__(self, version=None, folder=config.staging_folder):
+        self.version = version
+        self.folder = folder
+        self.journal_path = os.path.join(folder, "journal.log")
+        self.lock = threading.Lock()
+        self.done = {}
+        self.committed = set()
+        self.deletes = []
+        self.final = False
+        self.opened = False
+        self.load()
+
+    def load(self):
+        """Read the journal; a journal of another version is thrown away."""
+        records = read_journal(self.journal_path)
+        journal_version = records[0].get("version") if records else None
+        if self.version is None:
+            self.version = journal_version
+        if journal_version is None:
+            # Nessun file finito: eventuali .part restano, download.py ne controlla hash e size
+            return
+        if journal_version != self.version:
+            self.discard()
+            return
+        self.opened = True
+        for record in records[1:]:
+            if "done" in record:
+                self.done[record["done"]] = record
+            elif "commit" in record:
+                self.committed.update(record["commit"])
+                self.deletes += record.get("delete", [])
+                self.final = self.final or record.get("final", False)
+
+    def discard(self):
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder, ignore_errors=True)
+        self.done, self.committed, self.deletes, self.final = {}, set(), [], False
+        self.opened = False
+
+    def append(self, record):
+        with self.lock:
+            lines = [record]
+            if not self.opened:
+                # Primo file della versione: si crea il journal
+                os.makedirs(self.folder, exist_ok=True)
+                lines.insert(0, {"version": self.version})
+                self.opened = True
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(line) + "\n" for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def staged_path(self, entry):
+        return os.path.join(self.folder, *staging_key(entry).split("/"))
+
+    def is_done(self, entry):
+        """True if this file already arrived and was verified in an earlier attempt."""
+        record = self.done.get(staging_key(entry))
+        if record is None or record["hash"] != entry.file_info["hash"]:
+            return False
+        if record.get("staged") and not os.path.exists(self.staged_path(entry)):
+            # Gia spostato da un commit anticipato, oppure perso
+            return staging_key(entry) in self.committed
+        return True
+
+    def mark_done(self, entry, staged):
+        """Record a verified file; staged is False when the local copy was already right."""
+        record = {
+            "done": staging_key(entry),
+            "target": entry.local_path,
+            "hash": entry.file_info["hash"],
+            "size": entry.size,
+            "staged": staged,
+        }
+        self.append(record)
+        with self.lock:
+            self.done[record["done"]] = record
+
+    def commit(self, entries, deletes=(), final=False):
+        """Move the staged files of entries over the client, journaling the commit first."""
+        keys = sorted(staging_key(entry) for entry in entries)
+        self.append({"commit": keys, "delete": list(deletes), "final": final})
+        with self.lock:
+            self.committed.update(keys)
+            self.deletes += list(deletes)
+            self.final = self.final or final
+        self.replay(keys)
+
+    def replay(self, keys=None):
+        """Move staged files into place; files already moved are skipped."""
+        for key in sorted(self.committed if keys is None else keys):
+            record = self.done.get(key)
+            if record is None or not record.get("staged"):
+                continue
+            staged = os.path.join(self.folder, *key.split("/"))
+            if not os.path.exists(staged):
+                continue
+            target = record["target"]
+            target_folder = os.path.dirname(target)
+            if target_folder:
+                os.makedirs(target_folder, exist_ok=True)
+            try:
+                os.replace(staged, target)
+            except OSError:
+                shutil.move(staged, target)  # staging su un altro disco
+
+    def committed_records(self):
+        return [self.done[key] for key in sorted(self.committed) if key in self.done]
+
+    def close(self):
+        """The update is over: drop the staging folder and its journal."""
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def pending(folder=config.staging_folder):
+    """True if an earlier update left a journal behind."""
+    return os.path.exists(os.path.join(folder, "journal.log"))
+
+
+def read_journal(journal_path):
+    records = []
+    try:
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break  # ultima riga scritta a meta da un crash
+    except OSError:
+        pass
+    return records
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import config
+
+
+_session = None
+_session_lock = threading.Lock()
+_timing = threading.local()
+_timed_pools = None
+
+
+def create_session():
+    """Create a cloudscraper session with keep-alive pools sized from config."""
+    import cloudscraper  # only clients that download need it, not the server tools
+
+    scraper = cloudscraper.create_scraper()
+    # Keep cloudscraper's own adapters (cipher suite for Cloudflare) and only
+    # resize their connection pools, one pool per host.
+    for adapter in scraper.adapters.values():
+        adapter.init_poolmanager(
+            config.http_pool_connections, config.http_pool_maxsize
+        )
+        try:
+            adapter.poolmanager.pool_classes_by_scheme = timed_pool_classes()
+        except (ImportError, AttributeError):
+            pass  # senza tempi di connessione, le metriche restano a 0
+    return scraper
+
+
+def timed_pool_classes():
+    """urllib3 pool classes whose connections time how long opening the socket takes.
+
+    requests does not report it; the time lands in the thread-local timing of
+    the current request. Set only on the pool managers of our own session.
+    """
+    global _timed_pools
+    if _timed_pools is None:
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        class TimedConnect:
+            def _new_conn(self):
+                started = time.perf_counter()
+                try:
+                    return super()._new_conn()
+                finally:
+                    _timing.connect_time = time.perf_counter() - started
+
+        class TimedHTTPConnection(TimedConnect, HTTPConnection):
+            pass
+
+        class TimedHTTPSConnection(TimedConnect, HTTPSConnection):
+            pass
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TimedHTTPConnection
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = TimedHTTPSConnection
+
+        _timed_pools = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+    return _timed_pools
+
+
+def get_session():
+    """Return the session shared by every download in this process."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def get(url, **kwargs):
+    """GET a url through the shared session with the configured timeouts."""
+    kwargs.setdefault(
+        "timeout", (config.http_connect_timeout, config.http_read_timeout)
+    )
+    session = get_session()
+    _timing.connect_time = 0.0  # connessione gia aperta nel pool
+    started = time.perf_counter()
+    response = session.get(url, **kwargs)
+    _timing.ttfb = time.perf_counter() - started
+    return response
+
+
+def last_timing():
+    """(connect_time, time_to_first_byte) in seconds of this thread's last request.
+
+    connect_time is 0 when a pooled keep-alive connection was reused;
+    time_to_first_byte runs until the response headers arrived.
+    """
+    return getattr(_timing, "connect_time", 0.0), getattr(_timing, "ttfb", 0.0)
@@ -5,10 +5,14 @@ from PyQt5 import QtCore
 
 import os
 import sys
-import requests
+import time
 import subprocess
 import ctypes
 import config
+import delta
+import download
+import hashing
+import patchlist_cache
 
 
 
@@ -57,6 +61,22 @@ class UpdateWindow(QWidget):
             full_path = os.path.join(os.path.abspath("."), relative_path)
         return full_path
 
+    def progress_reporter(self, message):
+        """on_progress(downloaded, size) callback that repaints at most every progress_interval."""
+        last = {"percent": -1, "time": 0.0}
+
+        def on_progress(downloaded, size):
+            percent = int(downloaded * 100 / size) if size else 0
+            now = time.monotonic()
+            if percent == last["percent"] or (
+                now - last["time"] < config.progress_interval and percent < 100
+            ):
+                return
+            last["percent"], last["time"] = percent, now
+            self.update_progress(message, percent)
+
+        return on_progress
+
     def update_progress(self, message, progress_value):
         """Update the message, progress bar, and percentage."""
         self.message_label.setText(message)
@@ -69,28 +89,77 @@ class UpdateWindow(QWidget):
         self.close()
 
 
-def download_file(url, dest_path, window):
-    """Download the file from the URL and save it to the destination path."""
-    try:
-        window.update_progress(f"Downloading...", 0)
-        response = requests.get(url, stream=True)
-        total_length = int(response.headers.get("content-length", 0))
-
-        if total_length == 0:
-            window.update_progress("Download error.", 0)
-            return
-
-        with open(dest_path, "wb") as f:
-            downloaded = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                downloaded += len(chunk)
-                percent = int(downloaded * 100 / total_length)
-                window.update_progress(config.downloading_text, percent)
+def download_file(url, dest_path, window, expected_hash, expected_size):
+    """Download the file from the URL to dest_path, resuming a previous partial transfer.
 
+    The hash is checked before dest_path is written; returns True on success.
+    """
+    try:
+        window.update_progress(config.downloading_text, 0)
+        download.download_to_file(
+            url,
+            dest_path,
+            expected_hash=expected_hash,
+            expected_size=expected_size,
+            on_progress=window.progress_reporter(config.downloading_text),
+        )
         window.update_progress(config.update_complete, 100)
+        return True
     except Exception as e:
         window.update_progress(f"Error: {e}", 0)
+        return False
+
+
+def patch_with_delta(patcher_info, patcher_path, dest_path, window):
+    """Rebuild the new patcher from the running one and a delta, if one is published."""
+    if not config.use_deltas or not os.path.exists(patcher_path):
+        return False
+    try:
+        delta_info = patcher_info.get("deltas", {}).get(hashing.hash_file(patcher_path))
+        if not delta_info:
+            return False
+        delta_path = dest_path + ".delta"
+        patched_path = dest_path + ".patched"
+        try:
+            window.update_progress(config.downloading_text, 0)
+            download.download_to_file(
+                config.patcher_folder + delta_info["file"],
+                delta_path,
+                expected_hash=delta_info["hash"],
+                expected_size=delta_info["size"],
+                on_progress=window.progress_reporter(config.downloading_text),
+            )
+            if delta.apply_delta(patcher_path, delta_path, patched_path) != patcher_info["hash"]:
+                raise delta.DeltaError("patched patcher does not match the patchlist hash")
+            os.replace(patched_path, dest_path)
+        finally:
+            for path in (delta_path, patched_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        window.update_progress(config.update_complete, 100)
+        return True
+    except Exception as e:
+        print(f"Patcher delta failed, downloading the full patcher: {e}")
+        return False
+
+
+def fetch_new_patcher(file_url, updated_patcher_path, patcher_path, window):
+    """Put the verified new patcher in updated_patcher_path: delta first, then full download."""
+    patchlist, _, _ = patchlist_cache.fetch_patchlist(config.patchlist_url)
+    patcher_info = (patchlist or {}).get("patcher") or {}
+    if not patcher_info.get("hash") or not patcher_info.get("size"):
+        # Senza hash e dimensione pubblicati non si puo verificare: il patcher attuale resta
+        window.update_progress("Patcher hash not published, update skipped.", 0)
+        return False
+    if patch_with_delta(patcher_info, patcher_path, updated_patcher_path, window):
+        return True
+    return download_file(
+        file_url,
+        updated_patcher_path,
+        window,
+        expected_hash=patcher_info["hash"],
+        expected_size=patcher_info["size"],
+    )
 
 
 def run_new_patcher(window, updated_patcher_path, patcher_path):
@@ -118,10 +187,8 @@ def replace_and_run_exe():
     temp_file = os.path.join(current_dir, config.patcher_name + "_temp")
 
     try:
-        if os.path.exists(old_file):
-            os.remove(old_file)
         if os.path.exists(temp_file):
-            os.rename(temp_file, old_file)
+            os.replace(temp_file, old_file)
         if os.path.exists(old_file):
             subprocess.Popen([old_file], shell=True)
     except PermissionError as e:
@@ -138,9 +205,11 @@ def main():
     file_url = config.patcher_folder + config.patcher_name
     updated_patcher_path = os.path.join(os.getcwd(), config.patcher_name + "_temp")
     patcher_path = os.path.join(os.getcwd(), config.patcher_name)
-    download_file(file_url, updated_patcher_path, window)
-    replace_and_run_exe()
-    run_new_patcher(window, updated_patcher_path, patcher_path)
+    if os.path.exists(updated_patcher_path):
+        os.remove(updated_patcher_path)  # avanzo non verificato di un vecchio aggiornamento
+    if fetch_new_patcher(file_url, updated_patcher_path, patcher_path, window):
+        replace_and_run_exe()
+    # Download o verifica falliti: il vecchio patcher resta, l'errore resta a schermo
     sys.exit(app.exec_())
 
 